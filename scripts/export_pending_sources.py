@@ -6,16 +6,55 @@ import json
 import os
 import sqlite3
 from datetime import datetime
-from typing import Any, Dict, List
+from itertools import islice
+from typing import Any, Dict, Iterator
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used when orjson is not installed
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
 
 
 def db_conn(path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(path)
-    conn.execute("PRAGMA foreign_keys=ON;")
+    conn.row_factory = sqlite3.Row
+    conn.executescript(
+        """
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+        PRAGMA foreign_keys=ON;
+        """
+    )
     return conn
 
 
-def get_pending_sources(conn: sqlite3.Connection, user_id: int, limit: int) -> List[Dict[str, Any]]:
+def dumps_jsonl_line(row: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def parse_meta(meta_raw: str) -> Dict[str, Any]:
+    # Most rows store "" or "{}"; only hand object/array-looking blobs to the parser.
+    if not meta_raw or meta_raw[:1] not in ("{", "["):
+        return {}
+    try:
+        return _json_loads(meta_raw)
+    except json.JSONDecodeError:
+        return {}
+
+
+def iter_pending_sources(
+    conn: sqlite3.Connection,
+    user_id: int,
+    limit: int,
+    batch_size: int = 512,
+) -> Iterator[Dict[str, Any]]:
     cur = conn.execute(
         """
         SELECT id, source_type, source_label, content_text, file_path, url, meta, status, created_at
@@ -26,28 +65,15 @@ def get_pending_sources(conn: sqlite3.Connection, user_id: int, limit: int) -> L
         """,
         (user_id, limit),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for row in rows:
-        meta_raw = row[6] or ""
-        try:
-            parsed_meta = json.loads(meta_raw) if meta_raw else {}
-        except json.JSONDecodeError:
-            parsed_meta = {}
-        out.append(
-            {
-                "id": row[0],
-                "source_type": row[1],
-                "source_label": row[2],
-                "content_text": row[3],
-                "file_path": row[4],
-                "url": row[5],
-                "meta": parsed_meta,
-                "status": row[7],
-                "created_at": row[8],
-            }
-        )
-    return out
+    # Stream in batches so large content_text rows are never all held in memory at once.
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            d = dict(row)
+            d["meta"] = parse_meta(d["meta"] or "")
+            yield d
 
 
 def parse_args() -> argparse.Namespace:
@@ -61,19 +87,23 @@ def parse_args() -> argparse.Namespace:
 
 def main():
     args = parse_args()
-    with db_conn(args.db_path) as conn:
-        rows = get_pending_sources(conn, args.user_id, args.limit)
-
     if not args.output:
         os.makedirs("exports", exist_ok=True)
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         args.output = os.path.join("exports", f"pending_sources_user_{args.user_id}_{ts}.jsonl")
 
-    with open(args.output, "w", encoding="utf-8") as f:
-        for row in rows:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    exported = 0
+    with db_conn(args.db_path) as conn, open(args.output, "wb", buffering=1 << 16) as f:
+        rows = iter_pending_sources(conn, args.user_id, args.limit)
+        # One joined write per batch keeps write calls low while still streaming.
+        while True:
+            batch = [dumps_jsonl_line(row) for row in islice(rows, 512)]
+            if not batch:
+                break
+            f.write(b"".join(batch))
+            exported += len(batch)
 
-    print(f"Exported {len(rows)} pending sources to {args.output}")
+    print(f"Exported {exported} pending sources to {args.output}")
 
 
 if __name__ == "__main__":
@@ -2,16 +2,44 @@
 """Import Codex-generated cards JSON into SQLite and optionally mark sources processed."""
 
 import argparse
+import itertools
 import json
 import os
 import re
 import sqlite3
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used when orjson is not installed
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional: stream large inputs note-by-note when installed
+    ijson = None
+
+TAG_SPLIT_RE = re.compile(r"[,\s]+")
+
+
+def dumps_tags(tags: List[str]) -> str:
+    if orjson is not None:
+        return orjson.dumps(tags).decode("utf-8")
+    return json.dumps(tags, ensure_ascii=False, separators=(",", ":"))
 
 
 def db_conn(path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(path)
-    conn.execute("PRAGMA foreign_keys=ON;")
+    conn.executescript(
+        """
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+        PRAGMA foreign_keys=ON;
+        """
+    )
     return conn
 
 
@@ -70,11 +98,34 @@ def ensure_user(conn: sqlite3.Connection, user_id: int):
         conn.commit()
 
 
+def _dedup_str_tags(tags: List[str]) -> List[str]:
+    # Fast path for the usual list-of-str input; non-str items raise and defer to normalize_tags.
+    out: List[str] = []
+    seen = set()
+    append = out.append
+    add = seen.add
+    for tag in tags:
+        cleaned = "-".join(tag.split())
+        if not cleaned:
+            continue
+        key = cleaned.lower()
+        if key in seen:
+            continue
+        add(key)
+        append(cleaned)
+    return out
+
+
 def normalize_tags(tags: Any) -> List[str]:
+    if type(tags) is list:
+        try:
+            return _dedup_str_tags(tags)
+        except (AttributeError, TypeError):
+            pass
     if tags is None:
         return []
     if isinstance(tags, str):
-        tags = re.split(r"[,\s]+", tags.strip())
+        tags = TAG_SPLIT_RE.split(tags.strip())
     if not isinstance(tags, list):
         return []
     out: List[str] = []
@@ -82,7 +133,8 @@ def normalize_tags(tags: Any) -> List[str]:
     for tag in tags:
         if not isinstance(tag, str):
             continue
-        cleaned = re.sub(r"\s+", "-", tag.strip())
+        # Same result as strip() + re.sub(r"\s+", "-"), without the regex engine.
+        cleaned = "-".join(tag.split())
         if not cleaned:
             continue
         key = cleaned.lower()
@@ -107,22 +159,42 @@ def load_notes(path: str) -> List[Dict[str, Any]]:
     return notes
 
 
-def validate_note(raw: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
-    ntype = str(raw.get("type", "basic")).lower()
-    if ntype not in {"basic", "cloze"}:
-        return False, {}
-    front = str(raw.get("front", "")).strip()
-    back = str(raw.get("back", "")).strip()
-    cloze = str(raw.get("cloze", "")).strip()
-    extra = str(raw.get("extra", "")).strip()
-    tags = normalize_tags(raw.get("tags", []))
-    source_id = 0
-    try:
-        source_id = int(raw.get("source_id", 0) or 0)
-    except (TypeError, ValueError):
-        source_id = 0
-    origin = str(raw.get("origin", "codex")).strip() or "codex"
+def iter_notes(path: str) -> Iterator[Any]:
+    if ijson is None:
+        yield from load_notes(path)
+        return
+    with open(path, "rb") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == b"[":
+            yield from ijson.items(f, "item", use_float=True)
+            return
+        if first != b"{":
+            raise ValueError("Input JSON must be a list or an object with a 'notes' array.")
+        # Same validation as load_notes: a missing 'notes' key means no notes, any non-array value is an error.
+        events = ijson.parse(f, use_float=True)
+        for prefix, event, value in events:
+            if prefix == "notes":
+                break
+        else:
+            return
+        if event != "start_array":
+            raise ValueError("'notes' must be a JSON array.")
+        yield from ijson.items(itertools.chain([(prefix, event, value)], events), "notes.item")
 
+
+def _build_note(
+    ntype: str,
+    front: str,
+    back: str,
+    cloze: str,
+    extra: str,
+    tags: List[str],
+    source_id: int,
+    origin: str,
+) -> Tuple[bool, Dict[str, Any]]:
     if ntype == "basic" and (not front or not back):
         return False, {}
     if ntype == "cloze" and not cloze:
@@ -135,11 +207,55 @@ def validate_note(raw: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
         "cloze": cloze,
         "extra": extra,
         "tags": tags,
+        "tags_json": dumps_tags(tags),
         "source_id": source_id,
         "origin": origin,
     }
 
 
+def _validate_fast(raw: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    # Well-formed Codex output: str fields, int source_id. Anything else raises and
+    # validate_note falls back to the defensive coercions below.
+    ntype = raw["type"].lower()
+    front = raw["front"].strip()
+    back = raw["back"].strip()
+    cloze = raw.get("cloze", "").strip()
+    extra = raw.get("extra", "").strip()
+    source_id = raw.get("source_id", 0)
+    origin = raw.get("origin", "codex").strip() or "codex"
+    if type(source_id) is not int or type(ntype) is not str or type(front) is not str or type(back) is not str:
+        raise TypeError("not a plain note")
+    if type(cloze) is not str or type(extra) is not str or type(origin) is not str:
+        raise TypeError("not a plain note")
+    if ntype not in {"basic", "cloze"}:
+        return False, {}
+    return _build_note(ntype, front, back, cloze, extra, normalize_tags(raw.get("tags", [])), source_id, origin)
+
+
+def validate_note(raw: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    try:
+        return _validate_fast(raw)
+    except (KeyError, AttributeError, TypeError):
+        pass
+
+    ntype = str(raw.get("type", "basic")).lower()
+    if ntype not in {"basic", "cloze"}:
+        return False, {}
+    front = str(raw.get("front", "")).strip()
+    back = str(raw.get("back", "")).strip()
+    cloze = str(raw.get("cloze", "")).strip()
+    extra = str(raw.get("extra", "")).strip()
+    tags = normalize_tags(raw.get("tags", []))
+    source_id = 0
+    try:
+        source_id = int(raw.get("source_id", 0) or 0)
+    except (TypeError, ValueError):
+        source_id = 0
+    origin = str(raw.get("origin", "codex")).strip() or "codex"
+
+    return _build_note(ntype, front, back, cloze, extra, tags, source_id, origin)
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("--db-path", default=os.getenv("DB_PATH", "anki_bot.db"), help="Path to SQLite DB.")
@@ -161,53 +277,69 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def _mark_processed_sql(count: int) -> str:
+    placeholders = ",".join("?" * count)
+    return f"UPDATE sources SET status='processed' WHERE user_id=? AND id IN ({placeholders})"
+
+
+def mark_sources_processed(cur: sqlite3.Cursor, user_id: int, source_ids: List[int], chunk_size: int = 500):
+    # Chunked to stay well below SQLite's bound-parameter limit. Full chunks share one SQL
+    # string so sqlite3's statement cache reuses the prepared statement.
+    full_chunk_sql = _mark_processed_sql(chunk_size)
+    for start in range(0, len(source_ids), chunk_size):
+        chunk = source_ids[start : start + chunk_size]
+        sql = full_chunk_sql if len(chunk) == chunk_size else _mark_processed_sql(len(chunk))
+        cur.execute(sql, (user_id, *chunk))
+
+
+INSERT_NOTE_SQL = """
+INSERT INTO notes (user_id, type, front, back, cloze, extra, tags, source_id, origin)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
 def main():
     args = parse_args()
-    candidate_notes = load_notes(args.input)
 
-    inserted = 0
-    skipped = 0
+    counts = {"inserted": 0, "skipped": 0}
     processed_source_ids = set()
-    with db_conn(args.db_path) as conn:
-        ensure_schema(conn)
-        ensure_user(conn, args.user_id)
-        for idx, raw in enumerate(candidate_notes, start=1):
-            if not isinstance(raw, dict):
-                skipped += 1
-                continue
-            ok, note = validate_note(raw)
+
+    def note_rows() -> Iterator[Tuple[Any, ...]]:
+        for raw in iter_notes(args.input):
+            ok, note = validate_note(raw) if isinstance(raw, dict) else (False, {})
             if not ok:
-                skipped += 1
+                counts["skipped"] += 1
                 continue
-            conn.execute(
-                """
-                INSERT INTO notes (user_id, type, front, back, cloze, extra, tags, source_id, origin)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    args.user_id,
-                    note["type"],
-                    note["front"],
-                    note["back"],
-                    note["cloze"],
-                    note["extra"],
-                    json.dumps(note["tags"], ensure_ascii=False),
-                    note["source_id"],
-                    note["origin"],
-                ),
-            )
-            inserted += 1
+            counts["inserted"] += 1
             if note["source_id"] > 0:
                 processed_source_ids.add(note["source_id"])
+            yield (
+                args.user_id,
+                note["type"],
+                note["front"],
+                note["back"],
+                note["cloze"],
+                note["extra"],
+                note["tags_json"],
+                note["source_id"],
+                note["origin"],
+            )
+
+    with db_conn(args.db_path) as conn:
+        ensure_schema(conn)
+        ensure_user(conn, args.user_id)
+        # One transaction for the whole batch: per-row commits dominate bulk import time.
+        # Notes are validated as executemany pulls them, so only one is held in memory at a time.
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        cur.executemany(INSERT_NOTE_SQL, note_rows())
 
         if args.mark_processed and processed_source_ids:
-            for source_id in processed_source_ids:
-                conn.execute(
-                    "UPDATE sources SET status='processed' WHERE id=? AND user_id=?",
-                    (source_id, args.user_id),
-                )
+            mark_sources_processed(cur, args.user_id, sorted(processed_source_ids))
         conn.commit()
 
+    inserted = counts["inserted"]
+    skipped = counts["skipped"]
     print(f"Inserted {inserted} notes; skipped {skipped}.")
     if args.mark_processed:
         print(f"Marked {len(processed_source_ids)} source(s) as processed.")
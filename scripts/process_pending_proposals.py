@@ -4,12 +4,15 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 import sys
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple, Union
 
-import requests
+import httpx
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
@@ -26,38 +29,52 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Keep proposals even when Telegram sendMessage fails.",
     )
+    p.add_argument(
+        "--send-concurrency",
+        type=int,
+        default=8,
+        help="Maximum concurrent Telegram sendMessage requests across chats.",
+    )
     p.add_argument("--dry-run", action="store_true", help="Do not write to DB or send Telegram messages.")
     return p.parse_args()
 
 
-def pending_proposal_count(conn, user_id: int, source_id: int) -> int:
+def sources_with_pending_proposals(conn, user_id: int) -> Set[int]:
+    # Constant SQL text: repeated per-user calls hit sqlite3's prepared-statement cache.
     cur = conn.execute(
         """
-        SELECT COUNT(*)
+        SELECT DISTINCT source_id
         FROM note_proposals
-        WHERE user_id=? AND source_id=? AND status='pending'
+        WHERE user_id=? AND status='pending'
         """,
-        (user_id, source_id),
+        (user_id,),
     )
-    row = cur.fetchone()
-    return int(row[0]) if row else 0
+    return {int(r[0]) for r in cur.fetchall()}
 
 
-def user_ids_with_pending_text_sources(conn) -> List[int]:
+def pending_text_sources_by_user(conn, max_per_user: int) -> List[Tuple[int, int, str]]:
+    """Return (user_id, source_id, content_text) rows, at most max_per_user per user, in one query."""
     cur = conn.execute(
         """
-        SELECT DISTINCT user_id
-        FROM sources
-        WHERE status='pending' AND TRIM(content_text) <> ''
-        ORDER BY user_id
-        """
+        SELECT user_id, id, content_text
+        FROM (
+          SELECT user_id, id, content_text,
+                 ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS rn
+          FROM sources
+          WHERE status='pending' AND LENGTH(TRIM(content_text)) > 0
+        )
+        WHERE rn <= ?
+        ORDER BY user_id, id
+        """,
+        (max_per_user,),
     )
-    return [int(r[0]) for r in cur.fetchall()]
+    # Materialize in one pass straight off the cursor; main reuses the cursor for follow-up queries.
+    return [(int(r[0]), int(r[1]), r[2] or "") for r in cur]
 
 
-def send_proposal_message(chat_id: int, text: str) -> int:
+async def send_proposal_message(client: httpx.AsyncClient, chat_id: int, text: str) -> int:
     url = f"https://api.telegram.org/bot{app.TELEGRAM_BOT_TOKEN}/sendMessage"
-    resp = requests.post(url, json={"chat_id": chat_id, "text": text}, timeout=20)
+    resp = await client.post(url, json={"chat_id": chat_id, "text": text})
     resp.raise_for_status()
     payload = resp.json()
     if not payload.get("ok"):
@@ -69,8 +86,42 @@ def send_proposal_message(chat_id: int, text: str) -> int:
     return message_id
 
 
-def main() -> int:
-    args = parse_args()
+async def send_proposal_messages(
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    messages: List[Tuple[int, int, str]],
+) -> List[Union[int, BaseException]]:
+    """Send (chat_id, proposal_id, text) items one after another so they arrive in order."""
+    results: List[Union[int, BaseException]] = []
+    for chat_id, _, text in messages:
+        try:
+            async with sem:
+                results.append(await send_proposal_message(client, chat_id=chat_id, text=text))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def apply_send_results(conn, sent: List[Tuple[int, int, int]], expired: List[Tuple[int, int]]):
+    """Write (message_id, user_id, proposal_id) links and (user_id, proposal_id) expiries in one commit."""
+    if sent:
+        conn.executemany(
+            "UPDATE note_proposals SET telegram_message_id=? WHERE user_id=? AND id=?",
+            sent,
+        )
+    if expired:
+        conn.executemany(
+            """
+            UPDATE note_proposals
+            SET status='expired', note_id=0, decided_at=datetime('now')
+            WHERE user_id=? AND id=?
+            """,
+            expired,
+        )
+    conn.commit()
+
+
+async def run(args: argparse.Namespace) -> int:
     max_per_user = max(1, args.max_sources_per_user)
     summary: Dict[str, int] = {
         "users_scanned": 0,
@@ -83,57 +134,93 @@ def main() -> int:
         "message_failures": 0,
     }
     engines: Dict[str, int] = {}
+    # Last delivery task per user: a source's messages go out only after the previous source's for that chat.
+    deliveries: Dict[int, asyncio.Task] = {}
+    sem = asyncio.Semaphore(max(1, args.send_concurrency))
 
     with app.db_conn() as conn:
-        user_ids = user_ids_with_pending_text_sources(conn)
-        summary["users_scanned"] = len(user_ids)
-        for user_id in user_ids:
-            sources = app.get_pending_text_sources(conn, user_id=user_id, limit=max_per_user)
-            for source in sources:
-                source_id = int(source["id"])
-                summary["sources_scanned"] += 1
-                if pending_proposal_count(conn, user_id=user_id, source_id=source_id) > 0:
-                    summary["sources_skipped_existing_pending"] += 1
-                    continue
-
-                text = (source.get("content_text") or "").strip()
-                if not text:
-                    summary["sources_with_no_proposals"] += 1
-                    continue
-
-                notes, engine = app.generate_proposal_notes(text, app.ANKI_LANG, app.PROPOSAL_MAX_NOTES)
-                engines[engine] = engines.get(engine, 0) + 1
-                if not notes:
-                    summary["sources_with_no_proposals"] += 1
-                    continue
-
-                proposal_ids: List[int] = []
-                if not args.dry_run:
-                    for note in notes[: max(1, app.PROPOSAL_MAX_NOTES)]:
-                        proposal_ids.append(
-                            app.add_note_proposal(conn, user_id=user_id, source_id=source_id, note=note, telegram_message_id=0)
+        cur = conn.cursor()
+        rows = pending_text_sources_by_user(cur, max_per_user)
+        # One pooled keep-alive client for every sendMessage call in this run.
+        async with httpx.AsyncClient(timeout=20) as client:
+
+            async def _deliver(previous: Optional[asyncio.Task], messages: List[Tuple[int, int, str]]) -> None:
+                if previous is not None:
+                    await previous
+                results = await send_proposal_messages(client, sem, messages)
+                sent: List[Tuple[int, int, int]] = []
+                failed: List[Tuple[int, int]] = []
+                for (user_id, pid, _), result in zip(messages, results):
+                    if isinstance(result, BaseException):
+                        failed.append((user_id, pid))
+                    else:
+                        sent.append((result, user_id, pid))
+                summary["messages_sent"] += len(sent)
+                summary["message_failures"] += len(failed)
+                apply_send_results(conn, sent, [] if args.allow_no_message_id else failed)
+
+            try:
+                for user_id, user_rows in groupby(rows, key=itemgetter(0)):
+                    summary["users_scanned"] += 1
+                    existing_pending = sources_with_pending_proposals(cur, user_id=user_id)
+                    for _, source_id, content_text in user_rows:
+                        summary["sources_scanned"] += 1
+                        if source_id in existing_pending:
+                            summary["sources_skipped_existing_pending"] += 1
+                            continue
+
+                        text = content_text.strip()
+                        if not text:
+                            summary["sources_with_no_proposals"] += 1
+                            continue
+
+                        notes, engine = await app.generate_proposal_notes(
+                            text,
+                            app.ANKI_LANG,
+                            app.PROPOSAL_MAX_NOTES,
+                            cache_write=not args.dry_run,
                         )
-                    app.set_source_status(conn, user_id=user_id, source_id=source_id, status="processed")
-
-                summary["sources_with_proposals"] += 1
-                summary["proposals_inserted"] += len(proposal_ids) if not args.dry_run else len(notes)
-
-                if args.dry_run:
-                    continue
-
-                for pid, note in zip(proposal_ids, notes[: len(proposal_ids)]):
-                    try:
-                        msg_id = send_proposal_message(chat_id=user_id, text=app.format_proposal_message(pid, note))
-                        app.set_note_proposal_message_id(conn, user_id=user_id, proposal_id=pid, message_id=msg_id)
-                        summary["messages_sent"] += 1
-                    except Exception:
-                        summary["message_failures"] += 1
-                        if not args.allow_no_message_id:
-                            app.set_proposal_decision(conn, user_id=user_id, proposal_id=pid, status="expired")
+                        engines[engine] = engines.get(engine, 0) + 1
+                        if not notes:
+                            summary["sources_with_no_proposals"] += 1
+                            continue
+
+                        proposal_ids: List[int] = []
+                        if not args.dry_run:
+                            # set_source_status commits the proposal batch together with the status change.
+                            proposal_ids = app.add_note_proposals_batch(
+                                conn,
+                                user_id=user_id,
+                                source_id=source_id,
+                                notes=notes[: max(1, app.PROPOSAL_MAX_NOTES)],
+                                commit=False,
+                            )
+                            app.set_source_status(conn, user_id=user_id, source_id=source_id, status="processed")
+
+                        summary["sources_with_proposals"] += 1
+                        summary["proposals_inserted"] += len(proposal_ids) if not args.dry_run else len(notes)
+
+                        if args.dry_run:
+                            continue
+
+                        # Send and link this source's messages while the next source is generated, so a later
+                        # failure never leaves committed proposals without a Telegram message.
+                        messages = [
+                            (user_id, pid, app.format_proposal_message(pid, note))
+                            for pid, note in zip(proposal_ids, notes[: len(proposal_ids)])
+                        ]
+                        deliveries[user_id] = asyncio.create_task(_deliver(deliveries.get(user_id), messages))
+            finally:
+                if deliveries:
+                    await asyncio.gather(*deliveries.values())
 
     print(json.dumps({"summary": summary, "engines": engines}, ensure_ascii=False, indent=2))
     return 0
 
 
+def main() -> int:
+    return asyncio.run(run(parse_args()))
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -13,8 +13,9 @@ Generation modes:
 
 import base64
 import asyncio
+import atexit
+import functools
 import hashlib
-import io
 import json
 import logging
 import mimetypes
@@ -22,30 +23,43 @@ import os
 import random
 import re
 import shutil
+import signal
 import sqlite3
-import subprocess
 import sys
 import tempfile
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import genanki
-import requests
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
-from PIL import Image
 from telegram import InputFile, ReactionTypeEmoji, Update
 from telegram.constants import ChatAction
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, MessageReactionHandler, filters
 
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used when orjson is not installed
+    orjson = None
+
 # -------------------------
 # Config
 # -------------------------
 load_dotenv()
 
 
+def _str_env(name: str, default: str = "") -> str:
+    return (os.getenv(name, default) or "").strip()
+
+
 def _int_env(name: str, default: int) -> int:
     raw = os.getenv(name, str(default)).strip()
     try:
@@ -92,6 +106,10 @@ PROPOSAL_BACKEND_ALIASES = {
 
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Optional public HTTPS base URL; when set, Telegram pushes updates to it instead of the bot polling.
+TELEGRAM_WEBHOOK_URL = _str_env("TELEGRAM_WEBHOOK_URL").rstrip("/")
+TELEGRAM_WEBHOOK_PORT = _int_env("TELEGRAM_WEBHOOK_PORT", 8443)
+TELEGRAM_WEBHOOK_SECRET = _str_env("TELEGRAM_WEBHOOK_SECRET")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_VISION_MODEL = os.getenv("OPENAI_VISION_MODEL", "gpt-4o-mini")
 ANKI_LANG = os.getenv("ANKI_LANG", "en")
@@ -108,22 +126,27 @@ PROPOSAL_GENERATION_BACKEND = _canonical_env_choice(
 )
 PROPOSAL_MAX_NOTES = _int_env("PROPOSAL_MAX_NOTES", 3)
 PROPOSAL_CODEX_CMD = (os.getenv("PROPOSAL_CODEX_CMD", "codex") or "codex").strip()
-PROPOSAL_CODEX_MODEL = (os.getenv("PROPOSAL_CODEX_MODEL", "") or "").strip()
+PROPOSAL_CODEX_MODEL = _str_env("PROPOSAL_CODEX_MODEL")
 PROPOSAL_CODEX_TIMEOUT_SEC = _int_env("PROPOSAL_CODEX_TIMEOUT_SEC", 90)
-PROPOSAL_CODEX_CLI_JS = (
-    os.getenv("PROPOSAL_CODEX_CLI_JS", "/opt/homebrew/lib/node_modules/@openai/codex/dist/cli.js") or ""
-).strip()
+PROPOSAL_CODEX_CLI_JS = _str_env("PROPOSAL_CODEX_CLI_JS", "/opt/homebrew/lib/node_modules/@openai/codex/dist/cli.js")
 PROPOSAL_CODEX_STRICT_WORKSPACE_ONLY = (os.getenv("PROPOSAL_CODEX_STRICT_WORKSPACE_ONLY", "1").strip() != "0")
 PROPOSAL_CODEX_ALLOW_LEGACY_FALLBACK = (os.getenv("PROPOSAL_CODEX_ALLOW_LEGACY_FALLBACK", "0").strip() == "1")
 PROPOSAL_OLLAMA_MODEL = os.getenv("PROPOSAL_OLLAMA_MODEL", "llama3.2:3b")
 PROPOSAL_OLLAMA_BASE_URL = os.getenv("PROPOSAL_OLLAMA_BASE_URL", "http://127.0.0.1:11434").rstrip("/")
 PROPOSAL_OLLAMA_TIMEOUT_SEC = _int_env("PROPOSAL_OLLAMA_TIMEOUT_SEC", 120)
+# auto mode: start a paid OpenAI request only if no local backend answered within this many seconds (0 = never).
+PROPOSAL_AUTO_OPENAI_HEDGE_SEC = _int_env("PROPOSAL_AUTO_OPENAI_HEDGE_SEC", 0)
+# PROPOSAL_CODEX_CACHE is the older name from when only Codex results were cached.
+PROPOSAL_CACHE = _bool_env("PROPOSAL_CACHE", _bool_env("PROPOSAL_CODEX_CACHE", True))
+# Stored proposals older than this many days are pruned on the next cache write (0 = keep forever).
+PROPOSAL_CACHE_TTL_DAYS = _int_env("PROPOSAL_CACHE_TTL_DAYS", 30)
+PROPOSE_PENDING_CONCURRENCY = _int_env("PROPOSE_PENDING_CONCURRENCY", 4)
 AUTO_PROPOSE_FROM_TEXT = _bool_env("AUTO_PROPOSE_FROM_TEXT", True)
 MAX_SOURCE_TEXT_CHARS = _int_env("MAX_SOURCE_TEXT_CHARS", 12000)
 MAX_DOCUMENT_BYTES = _int_env("MAX_DOCUMENT_BYTES", 8_000_000)
 MOCHI_SYNC_FETCH_LIMIT = _int_env("MOCHI_SYNC_FETCH_LIMIT", 100)
-MOCHI_DEFAULT_API_KEY = (os.getenv("MOCHI_API_KEY", "") or "").strip()
-MOCHI_DEFAULT_DECK_ID = (os.getenv("MOCHI_DECK_ID", "") or "").strip()
+MOCHI_DEFAULT_API_KEY = _str_env("MOCHI_API_KEY")
+MOCHI_DEFAULT_DECK_ID = _str_env("MOCHI_DECK_ID")
 
 if not TELEGRAM_BOT_TOKEN:
     print("[ERROR] Missing TELEGRAM_BOT_TOKEN.")
@@ -139,7 +162,19 @@ if CARD_GENERATION_BACKEND == "openai-api" and not OPENAI_API_KEY:
 if PROPOSAL_GENERATION_BACKEND not in {"auto", "codex-cli", "ollama-local-mac", "openai-api", "heuristic"}:
     PROPOSAL_GENERATION_BACKEND = "auto"
 
-client: Optional[OpenAI] = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+client: Optional["OpenAI"] = None
+if OPENAI_API_KEY:
+    # The SDK adds ~0.5 s to start-up; only pay for it when OpenAI can actually be used.
+    from openai import OpenAI
+
+    client = OpenAI(api_key=OPENAI_API_KEY)
+
+# Keep-alive pool for local Ollama calls; proposals reuse connections and never block the event loop.
+ollama_client = httpx.AsyncClient(
+    base_url=PROPOSAL_OLLAMA_BASE_URL,
+    timeout=PROPOSAL_OLLAMA_TIMEOUT_SEC,
+    limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -152,6 +187,7 @@ logging.getLogger("httpcore").setLevel(logging.WARNING)
 os.makedirs(EXPORT_DIR, exist_ok=True)
 os.makedirs(SOURCE_DIR, exist_ok=True)
 os.makedirs(BACKUP_DIR, exist_ok=True)
+SOURCE_DIR_ABS = os.path.abspath(SOURCE_DIR)
 PROJECT_ROOT = str(Path(__file__).resolve().parent)
 
 # -------------------------
@@ -233,10 +269,17 @@ CREATE TABLE IF NOT EXISTS mochi_sync (
   UNIQUE(user_id, note_id),
   UNIQUE(user_id, mochi_card_id)
 );
+CREATE TABLE IF NOT EXISTS proposal_cache (
+  cache_key TEXT PRIMARY KEY,
+  notes_json TEXT NOT NULL DEFAULT '[]',
+  engine TEXT NOT NULL DEFAULT '',
+  created_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
 CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id);
 CREATE INDEX IF NOT EXISTS idx_sources_user_status_id ON sources(user_id, status, id);
 CREATE INDEX IF NOT EXISTS idx_note_proposals_user_status_id ON note_proposals(user_id, status, id);
 CREATE INDEX IF NOT EXISTS idx_note_proposals_user_msg ON note_proposals(user_id, telegram_message_id);
+CREATE INDEX IF NOT EXISTS idx_note_proposals_user_source_pending ON note_proposals(user_id, source_id) WHERE status='pending';
 CREATE INDEX IF NOT EXISTS idx_proposal_feedback_user_source_id ON proposal_feedback(user_id, source_id, id);
 CREATE INDEX IF NOT EXISTS idx_proposal_feedback_user_target_id ON proposal_feedback(user_id, target_proposal_id, id);
 CREATE INDEX IF NOT EXISTS idx_mochi_sync_user_note ON mochi_sync(user_id, note_id);
@@ -244,30 +287,65 @@ CREATE INDEX IF NOT EXISTS idx_mochi_sync_user_card ON mochi_sync(user_id, mochi
 """
 
 
-def db_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys=ON;")
-    return conn
+CONNECTION_PRAGMAS_SQL = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+PRAGMA foreign_keys=ON;
+"""
+_db_local = threading.local()
 
 
-def ensure_col(conn: sqlite3.Connection, table: str, name: str, ddl: str):
+def _close_db_conn(conn: sqlite3.Connection):
+    # SQLite's recommended close-time step: refresh planner stats so partial indexes such as
+    # idx_note_proposals_user_source_pending get chosen once tables have data.
     try:
-        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
-        conn.commit()
-    except sqlite3.OperationalError:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
         pass
+    conn.close()
+
+
+def db_conn() -> sqlite3.Connection:
+    # One long-lived connection per thread; `with db_conn() as conn:` commits/rolls back but never closes it.
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.executescript(CONNECTION_PRAGMAS_SQL)
+        atexit.register(_close_db_conn, conn)
+        _db_local.conn = conn
+    return conn
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> set:
+    return {str(r[1]) for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def ensure_col(conn: sqlite3.Connection, existing: set, table: str, name: str, ddl: str):
+    if name in existing:
+        return
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+    existing.add(name)
 
 
 with db_conn() as conn:
     conn.executescript(SCHEMA_SQL)
-    ensure_col(conn, "users", "mochi_api_key", "TEXT NOT NULL DEFAULT ''")
-    ensure_col(conn, "users", "mochi_deck_id", "TEXT NOT NULL DEFAULT ''")
-    ensure_col(conn, "notes", "source_id", "INTEGER NOT NULL DEFAULT 0")
-    ensure_col(conn, "notes", "origin", "TEXT NOT NULL DEFAULT 'unknown'")
-    ensure_col(conn, "note_proposals", "parent_proposal_id", "INTEGER NOT NULL DEFAULT 0")
-    ensure_col(conn, "note_proposals", "root_proposal_id", "INTEGER NOT NULL DEFAULT 0")
-    ensure_col(conn, "note_proposals", "revision_index", "INTEGER NOT NULL DEFAULT 0")
-    ensure_col(conn, "note_proposals", "feedback_id", "INTEGER NOT NULL DEFAULT 0")
+    # Column migrations and late indexes share one transaction (one fsync on start-up).
+    conn.execute("BEGIN IMMEDIATE")
+    users_cols = table_columns(conn, "users")
+    notes_cols = table_columns(conn, "notes")
+    proposal_cols = table_columns(conn, "note_proposals")
+    proposal_cache_cols = table_columns(conn, "proposal_cache")
+    ensure_col(conn, users_cols, "users", "mochi_api_key", "TEXT NOT NULL DEFAULT ''")
+    ensure_col(conn, users_cols, "users", "mochi_deck_id", "TEXT NOT NULL DEFAULT ''")
+    ensure_col(conn, notes_cols, "notes", "source_id", "INTEGER NOT NULL DEFAULT 0")
+    ensure_col(conn, notes_cols, "notes", "origin", "TEXT NOT NULL DEFAULT 'unknown'")
+    ensure_col(conn, proposal_cols, "note_proposals", "parent_proposal_id", "INTEGER NOT NULL DEFAULT 0")
+    ensure_col(conn, proposal_cols, "note_proposals", "root_proposal_id", "INTEGER NOT NULL DEFAULT 0")
+    ensure_col(conn, proposal_cols, "note_proposals", "revision_index", "INTEGER NOT NULL DEFAULT 0")
+    ensure_col(conn, proposal_cols, "note_proposals", "feedback_id", "INTEGER NOT NULL DEFAULT 0")
+    ensure_col(conn, proposal_cache_cols, "proposal_cache", "engine", "TEXT NOT NULL DEFAULT ''")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_note_proposals_user_root ON note_proposals(user_id, root_proposal_id, id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_note_proposals_user_source ON note_proposals(user_id, source_id, id)")
     conn.commit()
@@ -285,8 +363,8 @@ TEXT_MIME_TYPES = {
     "application/csv",
     "application/xml",
 }
-PROPOSAL_APPROVE_EMOJIS = {"👍", "✅", "🔥", "💚", "🟢"}
-PROPOSAL_REJECT_EMOJIS = {"👎", "❌", "🗑️"}
+PROPOSAL_APPROVE_EMOJIS = frozenset({"👍", "✅", "🔥", "💚", "🟢"})
+PROPOSAL_REJECT_EMOJIS = frozenset({"👎", "❌", "🗑️"})
 PROPOSAL_FEEDBACK_RE = re.compile(r"^\s*feedback\b[:\s-]*(.*)$", re.IGNORECASE | re.DOTALL)
 LANGUAGE_ALIASES = {
     "pl": "pl",
@@ -298,7 +376,7 @@ LANGUAGE_ALIASES = {
     "angielski": "en",
     "angielsku": "en",
 }
-POLISH_STOPWORDS = {
+POLISH_STOPWORDS = frozenset({
     "i",
     "oraz",
     "albo",
@@ -327,8 +405,8 @@ POLISH_STOPWORDS = {
     "która",
     "które",
     "się",
-}
-ENGLISH_STOPWORDS = {
+})
+ENGLISH_STOPWORDS = frozenset({
     "the",
     "a",
     "an",
@@ -353,20 +431,23 @@ ENGLISH_STOPWORDS = {
     "year",
     "start",
     "end",
-}
-LANG_DIRECTIVE_BRACKET_RE = re.compile(r"^\s*\[(?:lang|language)\s*[:=]\s*([A-Za-z-]{2,20})\]\s*(.*)$", re.IGNORECASE | re.DOTALL)
-LANG_DIRECTIVE_PREFIX_RE = re.compile(
-    r"^\s*(?:lang|language)\s*[:=]\s*([A-Za-z-]{2,20})\s*(?:[,;:-]\s*|\s+)(.*)$",
-    re.IGNORECASE | re.DOTALL,
-)
-LANG_WORD_PREFIX_RE = re.compile(
-    r"^\s*(pl|en|polish|english|polski|angielski)\s*(?:[,;:-]\s*|\s+)(.*)$",
-    re.IGNORECASE | re.DOTALL,
-)
-LANG_PHRASE_PREFIX_RE = re.compile(
-    r"^\s*(?:(?:in\s+(english|polish))|(?:po\s+(angielsku|polsku)))\s*(?:[,;:-]\s*|\s+)?(.*)$",
+})
+# The four directive forms (bracket, lang:, bare language word, "in english"/"po polsku") in one pass.
+# Alternatives are tried in that order; each captures the language token and the remaining text.
+LANG_DIRECTIVE_RE = re.compile(
+    r"^\s*(?:"
+    r"\[(?:lang|language)\s*[:=]\s*(?P<bracket>[A-Za-z-]{2,20})\]\s*(?P<bracket_rest>.*)"
+    r"|(?:lang|language)\s*[:=]\s*(?P<prefix>[A-Za-z-]{2,20})\s*(?:[,;:-]\s*|\s+)(?P<prefix_rest>.*)"
+    r"|(?P<word>pl|en|polish|english|polski|angielski)\s*(?:[,;:-]\s*|\s+)(?P<word_rest>.*)"
+    r"|(?:(?:in\s+(?P<phrase_in>english|polish))|(?:po\s+(?P<phrase_po>angielsku|polsku)))"
+    r"\s*(?:[,;:-]\s*|\s+)?(?P<phrase_rest>.*)"
+    r")$",
     re.IGNORECASE | re.DOTALL,
 )
+LANG_CODE_RE = re.compile(r"[a-z]{2}(?:-[a-z]{2})?")
+TAG_SEGMENT_SPLIT_RE = re.compile(r"[,\s]+")
+LANG_WORD_RE = re.compile(r"[a-zA-Ząćęłńóśżź]+")
+POLISH_DIACRITICS = frozenset("ąćęłńóśżź")
 
 
 def card_backend_label(mode: str) -> str:
@@ -389,39 +470,34 @@ def proposal_backend_label(mode: str) -> str:
 
 
 def normalize_tags(tags: List[str]) -> List[str]:
-    out: List[str] = []
-    seen = set()
+    # Keyed by lowercased tag; setdefault keeps the first spelling and dict order keeps input order.
+    out: Dict[str, str] = {}
     for tag in tags:
         if not isinstance(tag, str):
             continue
-        cleaned = re.sub(r"\s+", "-", tag.strip())
-        if not cleaned:
-            continue
-        key = cleaned.lower()
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(cleaned)
-    return out
+        # Same result as strip() + re.sub(r"\s+", "-"), without the regex engine.
+        cleaned = "-".join(tag.split())
+        if cleaned:
+            out.setdefault(cleaned.lower(), cleaned)
+    return list(out.values())
 
 
-def guess_mime(img: Image.Image) -> str:
-    fmt = (img.format or "").upper()
-    if fmt == "PNG":
+def guess_image_mime(image_bytes: bytes) -> str:
+    # Same answer PIL's format detection gave (PNG/WEBP, else JPEG), read straight from the magic bytes.
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
         return "image/png"
-    if fmt == "WEBP":
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
         return "image/webp"
     return "image/jpeg"
 
 
 def image_to_data_url(image_bytes: bytes) -> str:
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        mime = guess_mime(img)
-    except Exception:
-        mime = "image/jpeg"
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
-    return f"data:{mime};base64,{b64}"
+    b64 = base64.b64encode(image_bytes).decode("ascii")
+    return f"data:{guess_image_mime(image_bytes)};base64,{b64}"
+
+
+def image_file_to_data_url(path: str) -> str:
+    return image_to_data_url(Path(path).read_bytes())
 
 
 def safe_file_name(name: str) -> str:
@@ -430,31 +506,56 @@ def safe_file_name(name: str) -> str:
     return clean or "source"
 
 
-def persist_source_bytes(user_id: int, suggested_name: str, payload: bytes) -> str:
-    user_dir = os.path.join(SOURCE_DIR, str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
-    base_name = safe_file_name(suggested_name)
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
-    path = os.path.abspath(os.path.join(user_dir, f"{timestamp}_{base_name}"))
+_source_dirs_created: set = set()
+
+
+def _write_bytes(path: str, payload: bytes):
     with open(path, "wb") as f:
         f.write(payload)
+
+
+def reserve_source_path(user_id: int, suggested_name: str) -> str:
+    user_dir = os.path.join(SOURCE_DIR_ABS, str(user_id))
+    if user_dir not in _source_dirs_created:
+        os.makedirs(user_dir, exist_ok=True)
+        _source_dirs_created.add(user_dir)
+    base_name = safe_file_name(suggested_name)
+    # Same UTC "%Y%m%d_%H%M%S_%f" stamp as before, built from one time_ns() read without a datetime object.
+    secs, nanos = divmod(time.time_ns(), 1_000_000_000)
+    timestamp = f"{time.strftime('%Y%m%d_%H%M%S', time.gmtime(secs))}_{nanos // 1000:06d}"
+    # SOURCE_DIR_ABS is resolved once at start-up and base_name cannot contain separators,
+    # so the joined path is already absolute and normalized.
+    return os.path.join(user_dir, f"{timestamp}_{base_name}")
+
+
+async def persist_source_bytes(user_id: int, suggested_name: str, payload: bytes) -> str:
+    path = reserve_source_path(user_id, suggested_name)
+    # Uploads can be several MB; write them off the event loop.
+    await asyncio.to_thread(_write_bytes, path, payload)
     return path
 
 
 def decode_text_bytes(payload: bytes) -> str:
-    for enc in ("utf-8", "utf-16", "latin-1"):
-        try:
-            return payload.decode(enc)
-        except UnicodeDecodeError:
-            continue
-    return payload.decode("utf-8", errors="ignore")
+    # Pick the codec from the BOM when there is one; otherwise one strict UTF-8 pass,
+    # then latin-1 (which accepts any byte string) for legacy 8-bit files.
+    if payload[:3] == b"\xef\xbb\xbf":
+        return payload[3:].decode("utf-8", errors="replace")
+    if payload[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        return payload.decode("utf-16", errors="replace")
+    try:
+        return payload.decode("utf-8")
+    except UnicodeDecodeError:
+        return payload.decode("latin-1")
 
 
-def extract_text_from_document(file_name: str, mime_type: str, payload: bytes) -> str:
+def document_looks_text(file_name: str, mime_type: str) -> bool:
     ext = Path(file_name or "").suffix.lower()
     mime = (mime_type or "").lower()
-    looks_text = ext in TEXT_EXTENSIONS or mime.startswith("text/") or mime in TEXT_MIME_TYPES
-    if not looks_text:
+    return ext in TEXT_EXTENSIONS or mime.startswith("text/") or mime in TEXT_MIME_TYPES
+
+
+def extract_text_from_document(file_name: str, mime_type: str, payload: bytes) -> str:
+    if not document_looks_text(file_name, mime_type):
         return ""
     text = decode_text_bytes(payload).strip()
     if not text:
@@ -462,10 +563,16 @@ def extract_text_from_document(file_name: str, mime_type: str, payload: bytes) -
     return text[:MAX_SOURCE_TEXT_CHARS]
 
 
+def extract_text_from_document_file(path: str, file_name: str, mime_type: str) -> str:
+    if not document_looks_text(file_name, mime_type):
+        return ""
+    return extract_text_from_document(file_name, mime_type, Path(path).read_bytes())
+
+
 def parse_tags_segment(raw: str) -> List[str]:
     if not raw:
         return []
-    parts = re.split(r"[,\s]+", raw.strip())
+    parts = TAG_SEGMENT_SPLIT_RE.split(raw.strip())
     return normalize_tags([p for p in parts if p])
 
 
@@ -477,12 +584,12 @@ def split_pipe_args(raw: str) -> List[str]:
 
 
 def normalize_lang_code(raw: str) -> str:
-    token = re.sub(r"\s+", " ", (raw or "").strip().lower()).replace("_", "-")
+    token = " ".join((raw or "").lower().split()).replace("_", "-")
     if not token:
         return ""
     if token in LANGUAGE_ALIASES:
         return LANGUAGE_ALIASES[token]
-    if re.fullmatch(r"[a-z]{2}(?:-[a-z]{2})?", token):
+    if LANG_CODE_RE.fullmatch(token):
         return token[:2]
     return ""
 
@@ -492,29 +599,20 @@ def extract_language_directive(text: str) -> Tuple[str, str]:
     if not raw:
         return "", ""
 
-    m = LANG_DIRECTIVE_BRACKET_RE.match(raw)
-    if m:
-        lang = normalize_lang_code(m.group(1))
-        if lang:
-            return lang, (m.group(2) or "").strip()
-
-    m = LANG_DIRECTIVE_PREFIX_RE.match(raw)
+    m = LANG_DIRECTIVE_RE.match(raw)
     if m:
-        lang = normalize_lang_code(m.group(1))
-        if lang:
-            return lang, (m.group(2) or "").strip()
-
-    m = LANG_WORD_PREFIX_RE.match(raw)
-    if m:
-        lang = normalize_lang_code(m.group(1))
-        if lang:
-            return lang, (m.group(2) or "").strip()
-
-    m = LANG_PHRASE_PREFIX_RE.match(raw)
-    if m:
-        lang = normalize_lang_code(m.group(1) or m.group(2) or "")
+        kind = m.lastgroup
+        if kind == "bracket_rest":
+            token = m.group("bracket")
+        elif kind == "prefix_rest":
+            token = m.group("prefix")
+        elif kind == "word_rest":
+            token = m.group("word")
+        else:
+            token = m.group("phrase_in") or m.group("phrase_po") or ""
+        lang = normalize_lang_code(token)
         if lang:
-            return lang, (m.group(3) or "").strip()
+            return lang, (m.group(kind) or "").strip()
 
     return "", raw
 
@@ -524,19 +622,13 @@ def detect_language_from_text(text: str, default_lang: str = ANKI_LANG) -> str:
     if not raw:
         return default_lang
     t = raw.lower()
-    pl_score = 0
-    en_score = 0
-
-    if any(ch in "ąćęłńóśżź" for ch in t):
+    words = LANG_WORD_RE.findall(t)
+    # Every occurrence counts, so sum membership per word rather than intersecting sets.
+    pl_score = sum(map(POLISH_STOPWORDS.__contains__, words))
+    en_score = sum(map(ENGLISH_STOPWORDS.__contains__, words))
+    if not POLISH_DIACRITICS.isdisjoint(t):
         pl_score += 3
 
-    words = re.findall(r"[a-zA-Ząćęłńóśżź]+", t)
-    for w in words:
-        if w in POLISH_STOPWORDS:
-            pl_score += 1
-        if w in ENGLISH_STOPWORDS:
-            en_score += 1
-
     if pl_score == 0 and en_score == 0:
         return default_lang
     if pl_score > en_score:
@@ -548,6 +640,8 @@ def detect_language_from_text(text: str, default_lang: str = ANKI_LANG) -> str:
 
 def resolve_proposal_language(text: str, feedback: str = "", default_lang: str = ANKI_LANG) -> Tuple[str, str, str]:
     feedback_lang, cleaned_feedback = extract_language_directive(feedback)
+    # Parsed even when feedback already picked the language: a directive prefix in the text
+    # must still be stripped before the text is sent to the generator.
     text_lang, cleaned_text = extract_language_directive(text)
     candidate_text = (cleaned_text or text or "").strip()
     candidate_feedback = (cleaned_feedback or feedback or "").strip()
@@ -571,6 +665,10 @@ def format_note_previews(notes: List[Dict[str, Any]], limit: int = 4) -> str:
     return "\n".join(lines)
 
 
+HEURISTIC_PAIR_RE = re.compile(r"^(.+?)\s*(?:->|=>|:|-)\s*(.+)$")
+HEURISTIC_YEAR_RE = re.compile(r"\b\d{3,4}\b")
+
+
 def _line_to_basic_candidate(line: str) -> Optional[Dict[str, Any]]:
     s = line.strip()
     if not s:
@@ -581,7 +679,7 @@ def _line_to_basic_candidate(line: str) -> Optional[Dict[str, Any]]:
         back = s[q_idx + 1 :].strip(" -:;\t")
         if front and back:
             return {"type": "basic", "front": front, "back": back, "cloze": "", "extra": "", "tags": []}
-    m = re.match(r"^(.+?)\s*(?:->|=>|:|-)\s*(.+)$", s)
+    m = HEURISTIC_PAIR_RE.match(s)
     if m:
         front = m.group(1).strip()
         back = m.group(2).strip()
@@ -591,14 +689,23 @@ def _line_to_basic_candidate(line: str) -> Optional[Dict[str, Any]]:
 
 
 def heuristic_propose_notes_from_text(text: str, lang: str = ANKI_LANG) -> List[Dict[str, Any]]:
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    lines: List[str] = []
     notes: List[Dict[str, Any]] = []
 
-    for ln in lines:
-        cand = _line_to_basic_candidate(ln)
+    # Strip each line once and stop at the third candidate instead of pre-stripping the whole text.
+    add_line = lines.append
+    add_note = notes.append
+    line_candidate = _line_to_basic_candidate
+    extra = f"proposal ({lang})"
+    for raw_line in text.splitlines():
+        ln = raw_line.strip()
+        if not ln:
+            continue
+        add_line(ln)
+        cand = line_candidate(ln)
         if cand:
-            cand["extra"] = f"proposal ({lang})"
-            notes.append(cand)
+            cand["extra"] = extra
+            add_note(cand)
         if len(notes) >= 3:
             return notes
 
@@ -609,16 +716,17 @@ def heuristic_propose_notes_from_text(text: str, lang: str = ANKI_LANG) -> List[
     if not merged:
         return []
 
-    year_match = re.search(r"\b\d{3,4}\b", merged)
+    year_match = HEURISTIC_YEAR_RE.search(merged)
     if year_match:
         cloze = merged[: year_match.start()] + "{{c1::" + year_match.group(0) + "}}" + merged[year_match.end() :]
-        return [{"type": "cloze", "front": "", "back": "", "cloze": cloze, "extra": f"proposal ({lang})", "tags": []}]
+        return [{"type": "cloze", "front": "", "back": "", "cloze": cloze, "extra": extra, "tags": []}]
 
-    words = merged.split()
+    # Only the first two words and "at least four?" matter; don't split the whole text.
+    words = merged.split(None, 4)
     if len(words) >= 4:
         phrase = " ".join(words[:2])
         cloze = merged.replace(phrase, "{{c1::" + phrase + "}}", 1)
-        return [{"type": "cloze", "front": "", "back": "", "cloze": cloze, "extra": f"proposal ({lang})", "tags": []}]
+        return [{"type": "cloze", "front": "", "back": "", "cloze": cloze, "extra": extra, "tags": []}]
 
     term = merged.strip(" .,:;!?")
     if term:
@@ -628,7 +736,7 @@ def heuristic_propose_notes_from_text(text: str, lang: str = ANKI_LANG) -> List[
                 "front": f"What is {term}?",
                 "back": merged,
                 "cloze": "",
-                "extra": f"proposal ({lang})",
+                "extra": extra,
                 "tags": [],
             }
         ]
@@ -637,6 +745,9 @@ def heuristic_propose_notes_from_text(text: str, lang: str = ANKI_LANG) -> List[
 
 def clean_candidate_notes(notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     clean: List[Dict[str, Any]] = []
+    # Loop-invariant lookups bound once (LOAD_FAST instead of LOAD_GLOBAL/attribute per note).
+    append = clean.append
+    norm_tags = normalize_tags
     for n in notes:
         ntype = (n.get("type") or "basic").lower()
         front = (n.get("front") or "").strip()
@@ -646,10 +757,11 @@ def clean_candidate_notes(notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         tags = n.get("tags") or []
         if not isinstance(tags, list):
             tags = []
-        tags_clean = normalize_tags([t for t in tags if t and isinstance(t, str)])
+        # normalize_tags already skips non-str and blank tags; no pre-filtered copy needed.
+        tags_clean = norm_tags(tags)
         if ntype == "cloze":
             if cloze:
-                clean.append(
+                append(
                     {
                         "type": "cloze",
                         "front": "",
@@ -661,7 +773,7 @@ def clean_candidate_notes(notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
                 )
         else:
             if front and back:
-                clean.append(
+                append(
                     {
                         "type": "basic",
                         "front": front,
@@ -674,8 +786,10 @@ def clean_candidate_notes(notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return clean
 
 
-def proposal_prompt(lang: str, max_notes: int, feedback: str = "") -> str:
-    base = f"""
+@functools.lru_cache(maxsize=64)
+def _proposal_prompt_base(lang: str, max_notes: int) -> str:
+    # Only a handful of (lang, max_notes) pairs ever occur; build each rules block once.
+    return f"""
 Generate high-quality Anki proposal cards from input text.
 Output JSON only in this format:
 {{"notes":[{{"type":"basic|cloze","front":"","back":"","cloze":"","extra":"","tags":[]}}]}}
@@ -703,6 +817,10 @@ Rules:
 - Do not output commentary, markdown, or code fences.
 - If input is too vague for a good card, return empty notes.
 """.strip()
+
+
+def proposal_prompt(lang: str, max_notes: int, feedback: str = "") -> str:
+    base = _proposal_prompt_base(lang, max_notes)
     fb = (feedback or "").strip()
     if not fb:
         return base
@@ -713,45 +831,84 @@ Rules:
     )
 
 
+JSON_DECODER = json.JSONDecoder()
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:  # e.g. non-str keys or ints beyond 64 bits, which json still handles
+            pass
+    # Same compact, unescaped UTF-8 text orjson writes, so stored rows match with or without it.
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_line(obj: Any) -> bytes:
+    """Encode one JSONL line as UTF-8 bytes, newline included, for binary-mode writers."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
 def extract_json_payload(text: str) -> Optional[Dict[str, Any]]:
     raw = (text or "").strip()
     if not raw:
         return None
-    candidates = [raw]
-    if "```" in raw:
-        for m in re.finditer(r"```(?:json)?\s*([\s\S]*?)```", raw, flags=re.IGNORECASE):
-            block = (m.group(1) or "").strip()
-            if block:
-                candidates.append(block)
-    for cand in candidates:
+    try:
+        obj = _json_loads(raw)
+        if isinstance(obj, dict):
+            return obj
+    except Exception:
+        pass
+    # Let the C decoder consume an object from each "{" instead of counting braces in Python.
+    # This also covers ```json fenced blocks: an object inside a fence decodes the same from
+    # its "{" in the full text, so fences need no separate pass.
+    start = raw.find("{")
+    while start != -1:
         try:
-            obj = json.loads(cand)
-            if isinstance(obj, dict):
-                return obj
-        except Exception:
-            pass
-        start = cand.find("{")
-        while start != -1:
-            depth = 0
-            for idx in range(start, len(cand)):
-                ch = cand[idx]
-                if ch == "{":
-                    depth += 1
-                elif ch == "}":
-                    depth -= 1
-                    if depth == 0:
-                        piece = cand[start : idx + 1]
-                        try:
-                            obj = json.loads(piece)
-                            if isinstance(obj, dict):
-                                return obj
-                        except Exception:
-                            break
-            start = cand.find("{", start + 1)
+            obj, _ = JSON_DECODER.raw_decode(raw, start)
+        except ValueError:
+            start = raw.find("{", start + 1)
+            continue
+        if isinstance(obj, dict):
+            return obj
+        start = raw.find("{", start + 1)
     return None
 
 
-def _run_codex_exec_prompt(prompt: str) -> Tuple[int, str, str]:
+async def _run_codex_subprocess(cmd: List[str], env: Optional[Dict[str, str]] = None) -> Tuple[int, str, str]:
+    # Runs on the event loop's child watcher so a slow Codex call doesn't stall other updates.
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        start_new_session=True,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=max(15, PROPOSAL_CODEX_TIMEOUT_SEC))
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # Kill the whole process group (also when a faster backend won the auto race):
+        # a surviving grandchild would hold the pipes open.
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+        raise
+    return (
+        proc.returncode if proc.returncode is not None else -1,
+        stdout.decode("utf-8", errors="replace"),
+        stderr.decode("utf-8", errors="replace"),
+    )
+
+
+async def _run_codex_exec_prompt(prompt: str) -> Tuple[int, str, str]:
     with tempfile.TemporaryDirectory(prefix="codex_propose_") as tmp_dir:
         out_path = os.path.join(tmp_dir, "last_message.txt")
         cmd = [
@@ -773,13 +930,7 @@ def _run_codex_exec_prompt(prompt: str) -> Tuple[int, str, str]:
             cmd.extend(["-m", PROPOSAL_CODEX_MODEL])
         cmd.append(prompt)
 
-        proc = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=max(15, PROPOSAL_CODEX_TIMEOUT_SEC),
-            check=False,
-        )
+        returncode, stdout, stderr = await _run_codex_subprocess(cmd)
         last_message = ""
         if os.path.exists(out_path):
             try:
@@ -787,34 +938,26 @@ def _run_codex_exec_prompt(prompt: str) -> Tuple[int, str, str]:
                     last_message = f.read().strip()
             except Exception:
                 last_message = ""
-        combined = "\n".join(
-            x for x in [(proc.stdout or "").strip(), (proc.stderr or "").strip(), last_message] if x
-        ).strip()
-        return proc.returncode, combined, last_message
+        combined = "\n".join(x for x in [stdout.strip(), stderr.strip(), last_message] if x).strip()
+        return returncode, combined, last_message
 
 
-def _run_codex_legacy_prompt(prompt: str) -> Tuple[int, str]:
+async def _run_codex_legacy_prompt(prompt: str) -> Tuple[int, str]:
     cmd = [PROPOSAL_CODEX_CMD, "-q", "-C", PROJECT_ROOT]
     if PROPOSAL_CODEX_STRICT_WORKSPACE_ONLY:
         cmd.extend(["-c", "sandbox_permissions=[]"])
     if PROPOSAL_CODEX_MODEL:
         cmd.extend(["-m", PROPOSAL_CODEX_MODEL])
     cmd.append(prompt)
-    proc = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=max(15, PROPOSAL_CODEX_TIMEOUT_SEC),
-        check=False,
-    )
-    combined = "\n".join(x for x in [(proc.stdout or "").strip(), (proc.stderr or "").strip()] if x).strip()
+    returncode, stdout, stderr = await _run_codex_subprocess(cmd)
+    combined = "\n".join(x for x in [stdout.strip(), stderr.strip()] if x).strip()
     if "Please pass patch text through stdin" not in combined:
-        return proc.returncode, combined
+        return returncode, combined
     if not PROPOSAL_CODEX_ALLOW_LEGACY_FALLBACK:
-        return proc.returncode, combined
+        return returncode, combined
     # Older broken codex builds may incorrectly trigger an apply-patch branch.
     if not PROPOSAL_CODEX_CLI_JS or not os.path.exists(PROPOSAL_CODEX_CLI_JS) or shutil.which("node") is None:
-        return proc.returncode, combined
+        return returncode, combined
     script = (
         "process.argv=['node','x','-q'];"
         "if(process.env.CODEX_MODEL){process.argv.push('-m',process.env.CODEX_MODEL);}"
@@ -824,19 +967,79 @@ def _run_codex_legacy_prompt(prompt: str) -> Tuple[int, str]:
     env = os.environ.copy()
     env["CODEX_PROMPT"] = prompt
     env["CODEX_MODEL"] = PROPOSAL_CODEX_MODEL
-    proc2 = subprocess.run(
-        ["node", "--input-type=module", "-e", script],
-        capture_output=True,
-        text=True,
-        timeout=max(15, PROPOSAL_CODEX_TIMEOUT_SEC),
-        check=False,
-        env=env,
+    returncode2, stdout2, stderr2 = await _run_codex_subprocess(["node", "--input-type=module", "-e", script], env=env)
+    combined2 = "\n".join(x for x in [stdout2.strip(), stderr2.strip()] if x).strip()
+    return returncode2, combined2 or combined
+
+
+PROPOSAL_CACHE_MEMORY_SIZE = 256
+_proposal_cache_memory: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+
+def proposal_cache_key(text: str, lang: str, max_notes: int, feedback: str, backend: str) -> str:
+    # Whitespace-only differences (re-pasted text, trailing newlines) map to the same entry.
+    raw = json.dumps([" ".join(text.split()), lang, int(max_notes), " ".join(feedback.split()), backend], ensure_ascii=False)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def proposal_cache_backend() -> str:
+    # Switching the backend or any model invalidates cached proposals.
+    return "|".join(
+        [PROPOSAL_GENERATION_BACKEND, PROPOSAL_CODEX_MODEL, PROPOSAL_OLLAMA_MODEL, OPENAI_VISION_MODEL]
     )
-    combined2 = "\n".join(x for x in [(proc2.stdout or "").strip(), (proc2.stderr or "").strip()] if x).strip()
-    return proc2.returncode, combined2 or combined
 
 
-def codex_generate_proposal_notes_from_text(
+def get_cached_proposal_notes(key: str) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    entry = _proposal_cache_memory.get(key)
+    if entry is not None:
+        _proposal_cache_memory.move_to_end(key)
+    else:
+        with db_conn() as conn:
+            if PROPOSAL_CACHE_TTL_DAYS > 0:
+                row = conn.execute(
+                    "SELECT notes_json, engine FROM proposal_cache WHERE cache_key=? AND created_at >= datetime('now', ?)",
+                    (key, f"-{PROPOSAL_CACHE_TTL_DAYS} days"),
+                ).fetchone()
+            else:
+                row = conn.execute("SELECT notes_json, engine FROM proposal_cache WHERE cache_key=?", (key,)).fetchone()
+        if not row:
+            return None
+        entry = (str(row[0]), str(row[1] or ""))
+        _remember_proposal_notes(key, entry)
+    notes_json, engine = entry
+    try:
+        notes = _json_loads(notes_json)
+    except ValueError:
+        return None
+    if not isinstance(notes, list) or not notes or not engine:
+        return None
+    return notes, engine
+
+
+def store_cached_proposal_notes(key: str, notes: List[Dict[str, Any]], engine: str):
+    entry = (_json_dumps(notes), engine)
+    with db_conn() as conn:
+        # One row per distinct text/feedback; expire old rows here so the table stays bounded.
+        if PROPOSAL_CACHE_TTL_DAYS > 0:
+            conn.execute(
+                "DELETE FROM proposal_cache WHERE created_at < datetime('now', ?)",
+                (f"-{PROPOSAL_CACHE_TTL_DAYS} days",),
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO proposal_cache (cache_key, notes_json, engine) VALUES (?, ?, ?)",
+            (key, *entry),
+        )
+    _remember_proposal_notes(key, entry)
+
+
+def _remember_proposal_notes(key: str, entry: Tuple[str, str]):
+    _proposal_cache_memory[key] = entry
+    _proposal_cache_memory.move_to_end(key)
+    while len(_proposal_cache_memory) > PROPOSAL_CACHE_MEMORY_SIZE:
+        _proposal_cache_memory.popitem(last=False)
+
+
+async def codex_generate_proposal_notes_from_text(
     text: str,
     lang: str = ANKI_LANG,
     max_notes: int = PROPOSAL_MAX_NOTES,
@@ -847,11 +1050,11 @@ def codex_generate_proposal_notes_from_text(
 
     prompt = f"{proposal_prompt(lang, max_notes, feedback)}\n\nInput text:\n{text}"
     try:
-        code, combined, last_message = _run_codex_exec_prompt(prompt)
+        code, combined, last_message = await _run_codex_exec_prompt(prompt)
     except FileNotFoundError:
         logger.warning("Codex CLI not found for proposal generation: %s", PROPOSAL_CODEX_CMD)
         return []
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         logger.warning("Codex proposal generation timed out after %ss", PROPOSAL_CODEX_TIMEOUT_SEC)
         return []
     except Exception as e:
@@ -861,7 +1064,7 @@ def codex_generate_proposal_notes_from_text(
     lowered = combined.lower()
     if "unrecognized subcommand" in lowered or "unexpected argument 'exec'" in lowered:
         try:
-            code, combined = _run_codex_legacy_prompt(prompt)
+            code, combined = await _run_codex_legacy_prompt(prompt)
             last_message = ""
         except Exception as e:
             logger.warning("Codex legacy fallback failed: %s", e)
@@ -887,7 +1090,7 @@ def codex_generate_proposal_notes_from_text(
     return []
 
 
-def ollama_generate_proposal_notes_from_text(
+async def ollama_generate_proposal_notes_from_text(
     text: str,
     lang: str = ANKI_LANG,
     max_notes: int = PROPOSAL_MAX_NOTES,
@@ -901,11 +1104,7 @@ def ollama_generate_proposal_notes_from_text(
         "options": {"temperature": 0.2},
     }
     try:
-        r = requests.post(
-            f"{PROPOSAL_OLLAMA_BASE_URL}/api/generate",
-            json=payload,
-            timeout=PROPOSAL_OLLAMA_TIMEOUT_SEC,
-        )
+        r = await ollama_client.post("/api/generate", json=payload)
         r.raise_for_status()
         body = r.json()
         raw = body.get("response")
@@ -962,29 +1161,126 @@ def openai_generate_proposal_notes_from_text(
         return []
 
 
-def generate_proposal_notes(
+# Engines whose results are worth caching; heuristic output is cheap to recompute, and a
+# heuristic fallback should retry the LLM backends next time.
+CACHED_PROPOSAL_ENGINES = frozenset({"codex-cli", "ollama-local-mac", "openai-api"})
+_inflight_proposals: Dict[str, "asyncio.Task[Tuple[List[Dict[str, Any]], str]]"] = {}
+
+
+async def generate_proposal_notes(
     text: str,
     lang: str = ANKI_LANG,
     max_notes: int = PROPOSAL_MAX_NOTES,
     feedback: str = "",
+    cache_write: bool = True,
+) -> Tuple[List[Dict[str, Any]], str]:
+    if not PROPOSAL_CACHE or PROPOSAL_GENERATION_BACKEND == "heuristic":
+        return await _generate_proposal_notes_uncached(text, lang, max_notes, feedback)
+
+    # LLM round trips take seconds; a repeat of the same text/lang/feedback skips every provider.
+    cache_key = proposal_cache_key(text, lang, max_notes, feedback, proposal_cache_backend())
+    cached = get_cached_proposal_notes(cache_key)
+    if cached:
+        return cached
+    if not cache_write:
+        # Read-only callers (e.g. --dry-run scripts) must not insert cache rows.
+        return await _generate_proposal_notes_uncached(text, lang, max_notes, feedback)
+    # Concurrent identical requests (double-sent messages, retries) share one backend call.
+    task = _inflight_proposals.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_and_cache_proposal_notes(cache_key, text, lang, max_notes, feedback))
+        _inflight_proposals[cache_key] = task
+        task.add_done_callback(lambda _: _inflight_proposals.pop(cache_key, None))
+    notes, engine = await asyncio.shield(task)
+    return [dict(n) for n in notes], engine
+
+
+async def _generate_and_cache_proposal_notes(
+    cache_key: str,
+    text: str,
+    lang: str,
+    max_notes: int,
+    feedback: str,
+) -> Tuple[List[Dict[str, Any]], str]:
+    notes, engine = await _generate_proposal_notes_uncached(text, lang, max_notes, feedback)
+    if notes and engine in CACHED_PROPOSAL_ENGINES:
+        store_cached_proposal_notes(cache_key, notes, engine)
+    return notes, engine
+
+
+async def _delayed_openai_proposal_notes(
+    delay: float,
+    text: str,
+    lang: str,
+    max_notes: int,
+    feedback: str,
+) -> List[Dict[str, Any]]:
+    await asyncio.sleep(delay)
+    return await asyncio.to_thread(openai_generate_proposal_notes_from_text, text, lang, max_notes, feedback)
+
+
+async def _race_proposal_backends(
+    candidates: List[Tuple[str, Awaitable[List[Dict[str, Any]]]]],
+) -> Tuple[List[Dict[str, Any]], str]:
+    """Run backends concurrently and return the first non-empty result; the rest are cancelled."""
+    tasks = {asyncio.ensure_future(coro): engine for engine, coro in candidates}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                notes = task.result()
+                if notes:
+                    return notes, tasks[task]
+        return [], ""
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+async def _generate_proposal_notes_uncached(
+    text: str,
+    lang: str,
+    max_notes: int,
+    feedback: str,
 ) -> Tuple[List[Dict[str, Any]], str]:
+    # The OpenAI client blocks; run it in a worker thread so other updates keep flowing.
     backend = PROPOSAL_GENERATION_BACKEND
-    if backend in {"auto", "codex-cli"}:
-        notes = codex_generate_proposal_notes_from_text(text, lang, max_notes, feedback)
+    if backend == "auto":
+        # Codex and Ollama run side by side; whichever returns valid notes first wins.
+        candidates: List[Tuple[str, Awaitable[List[Dict[str, Any]]]]] = [
+            ("codex-cli", codex_generate_proposal_notes_from_text(text, lang, max_notes, feedback)),
+            ("ollama-local-mac", ollama_generate_proposal_notes_from_text(text, lang, max_notes, feedback)),
+        ]
+        if client is not None and PROPOSAL_AUTO_OPENAI_HEDGE_SEC > 0:
+            candidates.append(
+                (
+                    "openai-api",
+                    _delayed_openai_proposal_notes(PROPOSAL_AUTO_OPENAI_HEDGE_SEC, text, lang, max_notes, feedback),
+                )
+            )
+        notes, engine = await _race_proposal_backends(candidates)
+        if notes:
+            return notes, engine
+
+    if backend == "codex-cli":
+        notes = await codex_generate_proposal_notes_from_text(text, lang, max_notes, feedback)
         if notes:
             return notes, "codex-cli"
-        if backend == "codex-cli":
-            return [], "codex-cli-unavailable"
+        return [], "codex-cli-unavailable"
 
-    if backend in {"auto", "ollama-local-mac"}:
-        notes = ollama_generate_proposal_notes_from_text(text, lang, max_notes, feedback)
+    if backend == "ollama-local-mac":
+        notes = await ollama_generate_proposal_notes_from_text(text, lang, max_notes, feedback)
         if notes:
             return notes, "ollama-local-mac"
-        if backend == "ollama-local-mac":
-            return [], "ollama-local-mac-unavailable"
+        return [], "ollama-local-mac-unavailable"
 
     if backend == "openai-api":
-        notes = openai_generate_proposal_notes_from_text(text, lang, max_notes, feedback)
+        notes = await asyncio.to_thread(openai_generate_proposal_notes_from_text, text, lang, max_notes, feedback)
         if notes:
             return notes, "openai-api"
         return [], "openai-api-unavailable"
@@ -1008,39 +1304,63 @@ def _trim_for_telegram(value: str, limit: int = 900) -> str:
     return txt[: max(1, limit - 3)].rstrip() + "..."
 
 
+PROPOSAL_MESSAGE_FOOTER = (
+    "\n\nReact with 👍/✅ to approve+sync, or 👎/❌ to reject."
+    "\nReply with `feedback ...` (or `/feedback ...`) to revise."
+)
+
+
 def format_proposal_message(proposal_id: int, note: Dict[str, Any]) -> str:
-    tags = " ".join(note.get("tags", []))
+    # One f-string per message (footer included) instead of building the body and then
+    # concatenating the constant footer lines onto it.
+    tags = " ".join(note.get("tags", [])) or "(none)"
+    extra = _trim_for_telegram(note.get("extra", "") or "(none)", 300)
     if note["type"] == "cloze":
-        body = (
+        return (
             f"Proposal #{proposal_id}\n"
             f"Type: CLOZE\n"
             f"Cloze: {_trim_for_telegram(note.get('cloze',''), 1500)}\n"
-            f"Extra: {_trim_for_telegram(note.get('extra','') or '(none)', 300)}\n"
-            f"Tags: {tags or '(none)'}"
-        )
-    else:
-        body = (
-            f"Proposal #{proposal_id}\n"
-            f"Type: BASIC\n"
-            f"Front: {_trim_for_telegram(note.get('front',''), 800)}\n"
-            f"Back: {_trim_for_telegram(note.get('back',''), 1200)}\n"
-            f"Extra: {_trim_for_telegram(note.get('extra','') or '(none)', 300)}\n"
-            f"Tags: {tags or '(none)'}"
+            f"Extra: {extra}\n"
+            f"Tags: {tags}{PROPOSAL_MESSAGE_FOOTER}"
         )
     return (
-        body
-        + "\n\nReact with 👍/✅ to approve+sync, or 👎/❌ to reject."
-        + "\nReply with `feedback ...` (or `/feedback ...`) to revise."
+        f"Proposal #{proposal_id}\n"
+        f"Type: BASIC\n"
+        f"Front: {_trim_for_telegram(note.get('front',''), 800)}\n"
+        f"Back: {_trim_for_telegram(note.get('back',''), 1200)}\n"
+        f"Extra: {extra}\n"
+        f"Tags: {tags}{PROPOSAL_MESSAGE_FOOTER}"
     )
 
 
+def _hash_payload_bytes(payload: Dict[str, Any]) -> bytes:
+    # For the str/list/int payloads hashed here orjson's OPT_SORT_KEYS output is byte-identical
+    # to the compact sorted json.dumps below, so stored hashes stay valid.
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
 def stable_json_hash(payload: Dict[str, Any]) -> str:
-    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
-    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return hashlib.blake2b(_hash_payload_bytes(payload), digest_size=16).hexdigest()
 
 
-def note_hash(note: Dict[str, Any]) -> str:
-    payload = {
+def stored_hash_matches(stored: str, current_hash: str, payload: Dict[str, Any]) -> bool:
+    """Compare a stored mochi_sync hash with the already-computed current one (no re-hash)."""
+    if stored == current_hash:
+        return True
+    # mochi_sync rows written before the switch to BLAKE2b hold 64-char SHA-256 digests;
+    # compare those with SHA-256 so an upgrade doesn't look like every card changed.
+    if len(stored) == 64:
+        return stored == hashlib.sha256(_hash_payload_bytes(payload)).hexdigest()
+    return False
+
+
+def note_hash_payload(note: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "type": note.get("type", "basic"),
         "front": note.get("front", ""),
         "back": note.get("back", ""),
@@ -1048,33 +1368,96 @@ def note_hash(note: Dict[str, Any]) -> str:
         "extra": note.get("extra", ""),
         "tags": normalize_tags(note.get("tags", []) if isinstance(note.get("tags"), list) else []),
     }
-    return stable_json_hash(payload)
 
 
-def mochi_card_hash(card: Dict[str, Any]) -> str:
-    payload = {
+@functools.lru_cache(maxsize=8192)
+def _note_hash_cached(ntype: str, front: str, back: str, cloze: str, extra: str, tags: Tuple[str, ...]) -> str:
+    return stable_json_hash(
+        {"type": ntype, "front": front, "back": back, "cloze": cloze, "extra": extra, "tags": list(tags)}
+    )
+
+
+def note_hash(note: Dict[str, Any]) -> str:
+    # Sync passes re-hash the same unchanged notes every run; memoize on the field values.
+    p = note_hash_payload(note)
+    fields = (p["type"], p["front"], p["back"], p["cloze"], p["extra"])
+    # Only plain-string fields go through the cache: 1/True/1.0 compare equal as keys but
+    # serialize differently. normalize_tags already guarantees string tags.
+    if all(type(v) is str for v in fields):
+        return _note_hash_cached(*fields, tuple(p["tags"]))
+    return stable_json_hash(p)
+
+
+def mochi_card_hash_payload(card: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "content": card.get("content", ""),
         "deck-id": card.get("deck-id", ""),
         "tags": card.get("tags", []),
     }
-    return stable_json_hash(payload)
+
+
+@functools.lru_cache(maxsize=8192)
+def _mochi_card_hash_cached(content: str, deck_id: str, tags: Tuple[str, ...]) -> str:
+    return stable_json_hash({"content": content, "deck-id": deck_id, "tags": list(tags)})
+
+
+def mochi_card_hash(card: Dict[str, Any]) -> str:
+    p = mochi_card_hash_payload(card)
+    content, deck_id, tags = p["content"], p["deck-id"], p["tags"]
+    # Same plain-string rule as note_hash; tag objects are also unhashable.
+    if type(content) is str and type(deck_id) is str and type(tags) is list and all(type(t) is str for t in tags):
+        return _mochi_card_hash_cached(content, deck_id, tuple(tags))
+    return stable_json_hash(p)
+
+
+_last_backups: Dict[Tuple[int, str], Tuple[Tuple[int, ...], str]] = {}
+
+
+def _db_file_fingerprint() -> Tuple[int, ...]:
+    # Size + mtime of the DB and its WAL: in WAL mode recent commits only touch the -wal file.
+    out: List[int] = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            out.extend((-1, -1))
+            continue
+        out.extend((st.st_size, st.st_mtime_ns))
+    return tuple(out)
 
 
 def snapshot_db_backup(user_id: int, reason: str) -> str:
-    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    # Nothing written since the last snapshot for this user/reason: that file is still exact.
+    fingerprint = _db_file_fingerprint()
+    last = _last_backups.get((user_id, reason))
+    if last and last[0] == fingerprint and os.path.exists(last[1]):
+        return last[1]
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
     out_name = f"db_backup_u{user_id}_{safe_file_name(reason)}_{stamp}.sqlite3"
     out_path = os.path.abspath(os.path.join(BACKUP_DIR, out_name))
     os.makedirs(BACKUP_DIR, exist_ok=True)
-    with sqlite3.connect(DB_PATH) as src:
-        with sqlite3.connect(out_path) as dst:
-            src.backup(dst)
+    src = sqlite3.connect(DB_PATH)
+    dst = sqlite3.connect(out_path)
+    try:
+        # Copy in 256-page steps so writers from other connections are not locked out for the whole copy.
+        src.backup(dst, pages=256, sleep=0.001)
+    finally:
+        dst.close()
+        src.close()
+    _last_backups[(user_id, reason)] = (fingerprint, out_path)
     return out_path
 
 
 # -------------------------
 # DB helpers
 # -------------------------
+# User rows are never deleted, so once seen (or committed here) a user_id needs no further lookups.
+_known_user_ids: set = set()
+
+
 def ensure_user(conn: sqlite3.Connection, user_id: int):
+    if user_id in _known_user_ids:
+        return
     cur = conn.execute("SELECT user_id FROM users WHERE user_id=?", (user_id,))
     if not cur.fetchone():
         conn.execute(
@@ -1082,6 +1465,7 @@ def ensure_user(conn: sqlite3.Connection, user_id: int):
             (user_id, DEFAULT_DECK_NAME),
         )
         conn.commit()
+    _known_user_ids.add(user_id)
 
 
 def set_deck_name(conn: sqlite3.Connection, user_id: int, name: str):
@@ -1136,11 +1520,13 @@ def add_source(
     url: str = "",
     meta: Optional[Dict[str, Any]] = None,
     status: str = "pending",
+    commit: bool = True,
 ) -> int:
     ensure_user(conn, user_id)
     if status not in {"pending", "processed", "ignored"}:
         status = "pending"
-    meta_json = json.dumps(meta or {}, ensure_ascii=False)
+    # The column is NOT NULL DEFAULT '': most sources carry no meta, so store '' rather than "{}".
+    meta_json = _json_dumps(meta) if meta else ""
     cur = conn.execute(
         """
         INSERT INTO sources (user_id, source_type, source_label, content_text, file_path, url, meta, status)
@@ -1157,7 +1543,8 @@ def add_source(
             status,
         ),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
     return int(cur.lastrowid)
 
 
@@ -1172,6 +1559,26 @@ def set_source_status(conn: sqlite3.Connection, user_id: int, source_id: int, st
     return cur.rowcount > 0
 
 
+def _source_row_to_dict(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    meta_raw = row[6] or ""
+    try:
+        # '' (and "{}" in rows written before add_source stopped storing it) needs no parse.
+        parsed_meta = _json_loads(meta_raw) if meta_raw and meta_raw != "{}" else {}
+    except json.JSONDecodeError:
+        parsed_meta = {}
+    return {
+        "id": row[0],
+        "source_type": row[1],
+        "source_label": row[2],
+        "content_text": row[3],
+        "file_path": row[4],
+        "url": row[5],
+        "meta": parsed_meta,
+        "status": row[7],
+        "created_at": row[8],
+    }
+
+
 def get_user_sources(
     conn: sqlite3.Connection,
     user_id: int,
@@ -1194,28 +1601,7 @@ def get_user_sources(
         """,
         tuple(args),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for row in rows:
-        meta_raw = row[6] or ""
-        try:
-            parsed_meta = json.loads(meta_raw) if meta_raw else {}
-        except json.JSONDecodeError:
-            parsed_meta = {}
-        out.append(
-            {
-                "id": row[0],
-                "source_type": row[1],
-                "source_label": row[2],
-                "content_text": row[3],
-                "file_path": row[4],
-                "url": row[5],
-                "meta": parsed_meta,
-                "status": row[7],
-                "created_at": row[8],
-            }
-        )
-    return out
+    return [_source_row_to_dict(row) for row in cur]
 
 
 def get_source_by_id(conn: sqlite3.Connection, user_id: int, source_id: int) -> Optional[Dict[str, Any]]:
@@ -1231,22 +1617,7 @@ def get_source_by_id(conn: sqlite3.Connection, user_id: int, source_id: int) ->
     row = cur.fetchone()
     if not row:
         return None
-    meta_raw = row[6] or ""
-    try:
-        parsed_meta = json.loads(meta_raw) if meta_raw else {}
-    except json.JSONDecodeError:
-        parsed_meta = {}
-    return {
-        "id": row[0],
-        "source_type": row[1],
-        "source_label": row[2],
-        "content_text": row[3],
-        "file_path": row[4],
-        "url": row[5],
-        "meta": parsed_meta,
-        "status": row[7],
-        "created_at": row[8],
-    }
+    return _source_row_to_dict(row)
 
 
 def get_pending_text_sources(conn: sqlite3.Connection, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
@@ -1260,28 +1631,7 @@ def get_pending_text_sources(conn: sqlite3.Connection, user_id: int, limit: int
         """,
         (user_id, max(1, limit)),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for row in rows:
-        meta_raw = row[6] or ""
-        try:
-            parsed_meta = json.loads(meta_raw) if meta_raw else {}
-        except json.JSONDecodeError:
-            parsed_meta = {}
-        out.append(
-            {
-                "id": row[0],
-                "source_type": row[1],
-                "source_label": row[2],
-                "content_text": row[3],
-                "file_path": row[4],
-                "url": row[5],
-                "meta": parsed_meta,
-                "status": row[7],
-                "created_at": row[8],
-            }
-        )
-    return out
+    return [_source_row_to_dict(row) for row in cur]
 
 
 def pending_source_count(conn: sqlite3.Connection, user_id: int) -> int:
@@ -1290,6 +1640,12 @@ def pending_source_count(conn: sqlite3.Connection, user_id: int) -> int:
     return int(row[0]) if row else 0
 
 
+INSERT_NOTE_SQL = """
+INSERT INTO notes (user_id, type, front, back, cloze, extra, tags, source_id, origin)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
 def add_note(
     conn: sqlite3.Connection,
     user_id: int,
@@ -1301,14 +1657,12 @@ def add_note(
     tags: List[str],
     source_id: int = 0,
     origin: str = "manual",
+    commit: bool = True,
 ) -> int:
     ensure_user(conn, user_id)
-    tags_json = json.dumps(normalize_tags(tags), ensure_ascii=False)
+    tags_json = _json_dumps(normalize_tags(tags))
     cur = conn.execute(
-        """
-        INSERT INTO notes (user_id, type, front, back, cloze, extra, tags, source_id, origin)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
+        INSERT_NOTE_SQL,
         (
             user_id,
             note_type,
@@ -1321,10 +1675,42 @@ def add_note(
             origin,
         ),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
     return int(cur.lastrowid)
 
 
+def add_notes_batch(
+    conn: sqlite3.Connection,
+    user_id: int,
+    notes: List[Dict[str, Any]],
+    source_id: int = 0,
+    origin: str = "manual",
+    commit: bool = True,
+) -> int:
+    """Insert candidate-note dicts with one executemany; commit=False leaves the transaction to the caller."""
+    ensure_user(conn, user_id)
+    rows = [
+        (
+            user_id,
+            n["type"],
+            n.get("front", ""),
+            n.get("back", ""),
+            n.get("cloze", ""),
+            n.get("extra", ""),
+            _json_dumps(normalize_tags(n.get("tags", []))),
+            source_id,
+            origin,
+        )
+        for n in notes
+    ]
+    if rows:
+        conn.executemany(INSERT_NOTE_SQL, rows)
+    if commit:
+        conn.commit()
+    return len(rows)
+
+
 def get_user_notes(conn: sqlite3.Connection, user_id: int) -> List[Dict[str, Any]]:
     cur = conn.execute(
         """
@@ -1335,24 +1721,23 @@ def get_user_notes(conn: sqlite3.Connection, user_id: int) -> List[Dict[str, Any
         """,
         (user_id,),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        out.append(
-            {
-                "id": r[0],
-                "type": r[1],
-                "front": r[2],
-                "back": r[3],
-                "cloze": r[4],
-                "extra": r[5],
-                "tags": json.loads(r[6]) if r[6] else [],
-                "source_id": int(r[7] or 0),
-                "origin": r[8] or "unknown",
-                "created_at": r[9],
-            }
-        )
-    return out
+    # Build the dicts straight off the cursor; no intermediate fetchall() list. A dict display
+    # with positional reads is faster here than dict(zip(cols, r)) plus a fix-up pass over it.
+    return [
+        {
+            "id": r[0],
+            "type": r[1],
+            "front": r[2],
+            "back": r[3],
+            "cloze": r[4],
+            "extra": r[5],
+            "tags": _json_loads(r[6]) if r[6] else [],
+            "source_id": int(r[7] or 0),
+            "origin": r[8] or "unknown",
+            "created_at": r[9],
+        }
+        for r in cur
+    ]
 
 
 def count_user_notes(conn: sqlite3.Connection, user_id: int) -> int:
@@ -1361,6 +1746,21 @@ def count_user_notes(conn: sqlite3.Connection, user_id: int) -> int:
     return int(row[0]) if row else 0
 
 
+def get_user_status_summary(conn: sqlite3.Connection, user_id: int) -> Tuple[int, int, str]:
+    """Return (note_count, pending_source_count, deck_name) in one statement."""
+    ensure_user(conn, user_id)
+    row = conn.execute(
+        """
+        SELECT
+          (SELECT COUNT(*) FROM notes WHERE user_id=?),
+          (SELECT COUNT(*) FROM sources WHERE user_id=? AND status='pending'),
+          (SELECT deck_name FROM users WHERE user_id=?)
+        """,
+        (user_id, user_id, user_id),
+    ).fetchone()
+    return int(row[0]), int(row[1]), row[2] or DEFAULT_DECK_NAME
+
+
 def clear_user_notes(conn: sqlite3.Connection, user_id: int) -> int:
     cur = conn.execute("DELETE FROM notes WHERE user_id=?", (user_id,))
     conn.commit()
@@ -1387,7 +1787,7 @@ def get_note_by_id(conn: sqlite3.Connection, user_id: int, note_id: int) -> Opti
         "back": row[3],
         "cloze": row[4],
         "extra": row[5],
-        "tags": json.loads(row[6]) if row[6] else [],
+        "tags": _json_loads(row[6]) if row[6] else [],
         "source_id": int(row[7] or 0),
         "origin": row[8] or "unknown",
         "created_at": row[9],
@@ -1405,26 +1805,38 @@ def update_note_fields(
     extra: str,
     tags: List[str],
     origin: str,
+    commit: bool = True,
 ):
-    conn.execute(
+    update_note_fields_batch(
+        conn,
+        user_id,
+        [(note_id, note_type, front, back, cloze, extra, tags)],
+        origin=origin,
+        commit=commit,
+    )
+
+
+def update_note_fields_batch(
+    conn: sqlite3.Connection,
+    user_id: int,
+    updates: List[Tuple[int, str, str, str, str, str, List[str]]],
+    origin: str,
+    commit: bool = True,
+):
+    """Apply (note_id, type, front, back, cloze, extra, tags) updates in one executemany."""
+    conn.executemany(
         """
         UPDATE notes
         SET type=?, front=?, back=?, cloze=?, extra=?, tags=?, origin=?
         WHERE id=? AND user_id=?
         """,
-        (
-            note_type,
-            front,
-            back,
-            cloze,
-            extra,
-            json.dumps(normalize_tags(tags), ensure_ascii=False),
-            origin,
-            note_id,
-            user_id,
-        ),
+        [
+            (note_type, front, back, cloze, extra, _json_dumps(normalize_tags(tags)), origin, note_id, user_id)
+            for note_id, note_type, front, back, cloze, extra, tags in updates
+        ],
     )
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
 def get_mochi_sync_rows(conn: sqlite3.Connection, user_id: int) -> List[Dict[str, Any]]:
@@ -1437,21 +1849,28 @@ def get_mochi_sync_rows(conn: sqlite3.Connection, user_id: int) -> List[Dict[str
         """,
         (user_id,),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        out.append(
-            {
-                "note_id": int(r[0]),
-                "mochi_card_id": r[1],
-                "mochi_deck_id": r[2],
-                "local_hash": r[3],
-                "remote_hash": r[4],
-                "remote_updated_at": r[5],
-                "last_synced_at": r[6],
-            }
-        )
-    return out
+    return [
+        {
+            "note_id": int(r[0]),
+            "mochi_card_id": r[1],
+            "mochi_deck_id": r[2],
+            "local_hash": r[3],
+            "remote_hash": r[4],
+            "remote_updated_at": r[5],
+            "last_synced_at": r[6],
+        }
+        for r in cur
+    ]
+
+
+# REPLACE drops whichever existing rows clash on (user_id, note_id) or (user_id, mochi_card_id)
+# before inserting, i.e. the old DELETE ... OR ... + INSERT pair as one statement.
+UPSERT_MOCHI_SYNC_SQL = """
+INSERT OR REPLACE INTO mochi_sync (
+  user_id, note_id, mochi_card_id, mochi_deck_id, local_hash, remote_hash, remote_updated_at, last_synced_at
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+"""
 
 
 def link_mochi_sync(
@@ -1463,18 +1882,10 @@ def link_mochi_sync(
     local_hash: str,
     remote_hash: str,
     remote_updated_at: str,
+    commit: bool = True,
 ):
     conn.execute(
-        "DELETE FROM mochi_sync WHERE user_id=? AND (note_id=? OR mochi_card_id=?)",
-        (user_id, note_id, mochi_card_id),
-    )
-    conn.execute(
-        """
-        INSERT INTO mochi_sync (
-          user_id, note_id, mochi_card_id, mochi_deck_id, local_hash, remote_hash, remote_updated_at, last_synced_at
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
-        """,
+        UPSERT_MOCHI_SYNC_SQL,
         (
             user_id,
             note_id,
@@ -1485,34 +1896,59 @@ def link_mochi_sync(
             remote_updated_at,
         ),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
-def remove_mochi_sync_by_card(conn: sqlite3.Connection, user_id: int, mochi_card_id: str):
-    conn.execute("DELETE FROM mochi_sync WHERE user_id=? AND mochi_card_id=?", (user_id, mochi_card_id))
-    conn.commit()
+def link_mochi_sync_batch(
+    conn: sqlite3.Connection,
+    user_id: int,
+    links: List[Tuple[int, str, str, str, str, str]],
+    commit: bool = True,
+):
+    """Upsert (note_id, mochi_card_id, mochi_deck_id, local_hash, remote_hash, remote_updated_at) rows in one executemany."""
+    if links:
+        conn.executemany(UPSERT_MOCHI_SYNC_SQL, [(user_id, *link) for link in links])
+    if commit:
+        conn.commit()
 
 
-def add_note_proposal(
+def remove_mochi_sync_by_card(conn: sqlite3.Connection, user_id: int, mochi_card_id: str, commit: bool = True):
+    remove_mochi_sync_by_cards(conn, user_id, [mochi_card_id], commit=commit)
+
+
+def remove_mochi_sync_by_cards(conn: sqlite3.Connection, user_id: int, mochi_card_ids: List[str], commit: bool = True):
+    conn.executemany(
+        "DELETE FROM mochi_sync WHERE user_id=? AND mochi_card_id=?",
+        [(user_id, card_id) for card_id in mochi_card_ids],
+    )
+    if commit:
+        conn.commit()
+
+
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+INSERT_NOTE_PROPOSAL_SQL = """
+INSERT INTO note_proposals (
+  user_id, source_id, parent_proposal_id, root_proposal_id, revision_index, feedback_id,
+  type, front, back, cloze, extra, tags, telegram_message_id, status
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+""" + (" RETURNING id" if SQLITE_HAS_RETURNING else "")
+
+
+def _insert_note_proposal(
     conn: sqlite3.Connection,
     user_id: int,
     source_id: int,
     note: Dict[str, Any],
-    telegram_message_id: int = 0,
-    parent_proposal_id: int = 0,
-    root_proposal_id: int = 0,
-    revision_index: int = 0,
-    feedback_id: int = 0,
+    telegram_message_id: int,
+    parent_proposal_id: int,
+    root_proposal_id: int,
+    revision_index: int,
+    feedback_id: int,
 ) -> int:
-    ensure_user(conn, user_id)
     cur = conn.execute(
-        """
-        INSERT INTO note_proposals (
-          user_id, source_id, parent_proposal_id, root_proposal_id, revision_index, feedback_id,
-          type, front, back, cloze, extra, tags, telegram_message_id, status
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
-        """,
+        INSERT_NOTE_PROPOSAL_SQL,
         (
             user_id,
             source_id,
@@ -1525,25 +1961,93 @@ def add_note_proposal(
             note.get("back", ""),
             note.get("cloze", ""),
             note.get("extra", ""),
-            json.dumps(normalize_tags(note.get("tags", [])), ensure_ascii=False),
+            _json_dumps(normalize_tags(note.get("tags", []))),
             telegram_message_id,
         ),
     )
-    conn.commit()
-    proposal_id = int(cur.lastrowid)
+    return int(cur.fetchone()[0]) if SQLITE_HAS_RETURNING else int(cur.lastrowid)
+
+
+def add_note_proposal(
+    conn: sqlite3.Connection,
+    user_id: int,
+    source_id: int,
+    note: Dict[str, Any],
+    telegram_message_id: int = 0,
+    parent_proposal_id: int = 0,
+    root_proposal_id: int = 0,
+    revision_index: int = 0,
+    feedback_id: int = 0,
+) -> int:
+    ensure_user(conn, user_id)
+    proposal_id = _insert_note_proposal(
+        conn,
+        user_id,
+        source_id,
+        note,
+        telegram_message_id,
+        parent_proposal_id,
+        root_proposal_id,
+        revision_index,
+        feedback_id,
+    )
     if int(root_proposal_id or 0) <= 0:
         conn.execute(
             "UPDATE note_proposals SET root_proposal_id=? WHERE id=? AND user_id=?",
             (proposal_id, proposal_id, user_id),
         )
-        conn.commit()
+    conn.commit()
     return proposal_id
 
 
+def add_note_proposals_batch(
+    conn: sqlite3.Connection,
+    user_id: int,
+    source_id: int,
+    notes: List[Dict[str, Any]],
+    parent_proposal_id: int = 0,
+    root_proposal_id: int = 0,
+    revision_index: int = 0,
+    feedback_id: int = 0,
+    commit: bool = True,
+) -> List[int]:
+    """Insert several proposals in one transaction and return their ids in input order."""
+    ensure_user(conn, user_id)
+    proposal_ids = [
+        _insert_note_proposal(
+            conn,
+            user_id,
+            source_id,
+            note,
+            0,
+            parent_proposal_id,
+            root_proposal_id,
+            revision_index,
+            feedback_id,
+        )
+        for note in notes
+    ]
+    if proposal_ids and int(root_proposal_id or 0) <= 0:
+        conn.executemany(
+            "UPDATE note_proposals SET root_proposal_id=? WHERE id=? AND user_id=?",
+            [(pid, pid, user_id) for pid in proposal_ids],
+        )
+    if commit:
+        conn.commit()
+    return proposal_ids
+
+
 def set_note_proposal_message_id(conn: sqlite3.Connection, user_id: int, proposal_id: int, message_id: int):
-    conn.execute(
+    set_note_proposal_message_ids(conn, user_id, [(proposal_id, message_id)])
+
+
+def set_note_proposal_message_ids(conn: sqlite3.Connection, user_id: int, links: List[Tuple[int, int]]):
+    """Store (proposal_id, telegram_message_id) pairs with one executemany and one commit."""
+    if not links:
+        return
+    conn.executemany(
         "UPDATE note_proposals SET telegram_message_id=? WHERE id=? AND user_id=?",
-        (message_id, proposal_id, user_id),
+        [(message_id, proposal_id, user_id) for proposal_id, message_id in links],
     )
     conn.commit()
 
@@ -1553,6 +2057,7 @@ def get_pending_proposal_by_message(
     user_id: int,
     message_id: int,
 ) -> Optional[Dict[str, Any]]:
+    # Id columns come back as ints (0 when unset), so callers can use them without re-coercing.
     cur = conn.execute(
         """
         SELECT id, source_id, parent_proposal_id, root_proposal_id, revision_index, feedback_id,
@@ -1578,7 +2083,7 @@ def get_pending_proposal_by_message(
         "back": row[8],
         "cloze": row[9],
         "extra": row[10],
-        "tags": json.loads(row[11]) if row[11] else [],
+        "tags": _json_loads(row[11]) if row[11] else [],
         "status": row[12],
     }
 
@@ -1614,6 +2119,10 @@ def add_proposal_feedback(
 
 
 def get_user_proposals(conn: sqlite3.Connection, user_id: int, limit: int = 20000) -> List[Dict[str, Any]]:
+    return list(iter_user_proposals(conn, user_id=user_id, limit=limit))
+
+
+def iter_user_proposals(conn: sqlite3.Connection, user_id: int, limit: int = 20000) -> Iterator[Dict[str, Any]]:
     cur = conn.execute(
         """
         SELECT id, source_id, parent_proposal_id, root_proposal_id, revision_index, feedback_id,
@@ -1625,34 +2134,39 @@ def get_user_proposals(conn: sqlite3.Connection, user_id: int, limit: int = 2000
         """,
         (user_id, max(1, limit)),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        out.append(
-            {
-                "id": int(r[0]),
-                "source_id": int(r[1] or 0),
-                "parent_proposal_id": int(r[2] or 0),
-                "root_proposal_id": int(r[3] or 0),
-                "revision_index": int(r[4] or 0),
-                "feedback_id": int(r[5] or 0),
-                "type": r[6],
-                "front": r[7],
-                "back": r[8],
-                "cloze": r[9],
-                "extra": r[10],
-                "tags": json.loads(r[11]) if r[11] else [],
-                "telegram_message_id": int(r[12] or 0),
-                "status": r[13],
-                "note_id": int(r[14] or 0),
-                "created_at": r[15],
-                "decided_at": r[16],
-            }
-        )
-    return out
+    return (
+        {
+            "id": r[0],
+            "source_id": int(r[1] or 0),
+            "parent_proposal_id": int(r[2] or 0),
+            "root_proposal_id": int(r[3] or 0),
+            "revision_index": int(r[4] or 0),
+            "feedback_id": int(r[5] or 0),
+            "type": r[6],
+            "front": r[7],
+            "back": r[8],
+            "cloze": r[9],
+            "extra": r[10],
+            "tags": _json_loads(r[11]) if r[11] else [],
+            "telegram_message_id": int(r[12] or 0),
+            "status": r[13],
+            "note_id": int(r[14] or 0),
+            "created_at": r[15],
+            "decided_at": r[16],
+        }
+        for r in cur
+    )
 
 
 def get_user_proposal_feedback(conn: sqlite3.Connection, user_id: int, limit: int = 20000) -> List[Dict[str, Any]]:
+    return list(iter_user_proposal_feedback(conn, user_id=user_id, limit=limit))
+
+
+def iter_user_proposal_feedback(
+    conn: sqlite3.Connection,
+    user_id: int,
+    limit: int = 20000,
+) -> Iterator[Dict[str, Any]]:
     cur = conn.execute(
         """
         SELECT id, source_id, target_proposal_id, feedback_text, requested_lang, telegram_message_id, created_at
@@ -1663,21 +2177,18 @@ def get_user_proposal_feedback(conn: sqlite3.Connection, user_id: int, limit: in
         """,
         (user_id, max(1, limit)),
     )
-    rows = cur.fetchall()
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        out.append(
-            {
-                "id": int(r[0]),
-                "source_id": int(r[1] or 0),
-                "target_proposal_id": int(r[2] or 0),
-                "feedback_text": r[3] or "",
-                "requested_lang": r[4] or "",
-                "telegram_message_id": int(r[5] or 0),
-                "created_at": r[6],
-            }
-        )
-    return out
+    return (
+        {
+            "id": r[0],
+            "source_id": int(r[1] or 0),
+            "target_proposal_id": int(r[2] or 0),
+            "feedback_text": r[3] or "",
+            "requested_lang": r[4] or "",
+            "telegram_message_id": int(r[5] or 0),
+            "created_at": r[6],
+        }
+        for r in cur
+    )
 
 
 def set_proposal_decision(
@@ -1696,7 +2207,20 @@ def set_proposal_decision(
     conn.commit()
 
 
-def expire_pending_proposals_for_source(conn: sqlite3.Connection, user_id: int, source_id: int) -> int:
+def get_pending_proposal_ids_for_source(conn: sqlite3.Connection, user_id: int, source_id: int) -> List[int]:
+    cur = conn.execute(
+        "SELECT id FROM note_proposals WHERE user_id=? AND source_id=? AND status='pending' ORDER BY id",
+        (user_id, source_id),
+    )
+    return [int(r[0]) for r in cur.fetchall()]
+
+
+def expire_pending_proposals_for_source(
+    conn: sqlite3.Connection,
+    user_id: int,
+    source_id: int,
+    commit: bool = True,
+) -> int:
     cur = conn.execute(
         """
         UPDATE note_proposals
@@ -1705,7 +2229,8 @@ def expire_pending_proposals_for_source(conn: sqlite3.Connection, user_id: int,
         """,
         (user_id, source_id),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
     return int(cur.rowcount or 0)
 
 
@@ -1764,12 +2289,12 @@ def _parse_notes(resp: Any) -> List[Dict[str, Any]]:
             notes = parsed.get("notes", [])
         else:
             text = resp.output_text
-            data = json.loads(text)
+            data = _json_loads(text)
             notes = data.get("notes", [])
     except Exception:
         try:
             first_text = resp.output[0].content[0].text  # type: ignore[index]
-            data = json.loads(first_text)
+            data = _json_loads(first_text)
             notes = data.get("notes", [])
         except Exception as e:
             logger.exception("Parsing failure: %s", e)
@@ -1847,23 +2372,9 @@ def store_generated_notes(
     source_id: int,
     notes: List[Dict[str, Any]],
     origin: str,
+    commit: bool = True,
 ) -> int:
-    created = 0
-    for n in notes:
-        add_note(
-            conn,
-            user_id=user_id,
-            note_type=n["type"],
-            front=n.get("front", ""),
-            back=n.get("back", ""),
-            cloze=n.get("cloze", ""),
-            extra=n.get("extra", ""),
-            tags=n.get("tags", []),
-            source_id=source_id,
-            origin=origin,
-        )
-        created += 1
-    return created
+    return add_notes_batch(conn, user_id=user_id, notes=notes, source_id=source_id, origin=origin, commit=commit)
 
 
 # -------------------------
@@ -1907,23 +2418,32 @@ cloze_model = genanki.Model(
 )
 
 
+@functools.lru_cache(maxsize=1024)
 def stable_deck_id(user_id: int) -> int:
-    random.seed(user_id)
-    return random.randint(10**9, 2**31 - 1)
+    # A private Random yields the same ids the old global random.seed(user_id) did (Anki keys
+    # decks by id, so they must not change) without reseeding the shared module PRNG.
+    return random.Random(user_id).randint(10**9, 2**31 - 1)
+
+
+def _export_path(stem: str, ext: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{stem}_{time.strftime('%Y%m%d_%H%M%S')}.{ext}")
 
 
 def build_apkg(user_id: int, deck_name: str, notes: List[Dict[str, Any]]) -> str:
     deck = genanki.Deck(stable_deck_id(user_id), deck_name)
-    for n in notes:
-        if n["type"] == "cloze":
-            fields = [n.get("cloze", ""), n.get("extra", "")]
-            note = genanki.Note(model=cloze_model, fields=fields, tags=n.get("tags", []))
-        else:
-            fields = [n.get("front", ""), n.get("back", ""), n.get("extra", "")]
-            note = genanki.Note(model=basic_model, fields=fields, tags=n.get("tags", []))
-        deck.add_note(note)
-    out_name = f"{deck_name.replace(' ', '_')}_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.apkg"
-    out_path = os.path.join(EXPORT_DIR, out_name)
+    Note = genanki.Note
+    # Deck.add_note only appends; build the whole note list in one comprehension instead.
+    deck.notes.extend(
+        Note(model=cloze_model, fields=[n.get("cloze", ""), n.get("extra", "")], tags=n.get("tags", []))
+        if n["type"] == "cloze"
+        else Note(
+            model=basic_model,
+            fields=[n.get("front", ""), n.get("back", ""), n.get("extra", "")],
+            tags=n.get("tags", []),
+        )
+        for n in notes
+    )
+    out_path = _export_path(f"{deck_name.replace(' ', '_')}_{user_id}", "apkg")
     pkg = genanki.Package(deck)
     pkg.write_to_file(out_path)
     return out_path
@@ -1932,26 +2452,25 @@ def build_apkg(user_id: int, deck_name: str, notes: List[Dict[str, Any]]) -> str
 def build_csv(user_id: int, deck_name: str, notes: List[Dict[str, Any]]) -> str:
     import csv
 
-    out_name = f"{deck_name.replace(' ', '_')}_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    out_path = os.path.join(EXPORT_DIR, out_name)
-    with open(out_path, "w", encoding="utf-8", newline="") as f:
+    out_path = _export_path(f"{deck_name.replace(' ', '_')}_{user_id}", "csv")
+    with open(out_path, "w", encoding="utf-8", newline="", buffering=1 << 20) as f:
         writer = csv.writer(f)
         writer.writerow(["type", "front", "back", "cloze", "extra", "tags", "source_id", "origin", "created_at"])
-        for n in notes:
-            tags = " ".join([t for t in n.get("tags", [])])
-            writer.writerow(
-                [
-                    n.get("type", "basic"),
-                    n.get("front", ""),
-                    n.get("back", ""),
-                    n.get("cloze", ""),
-                    n.get("extra", ""),
-                    tags,
-                    n.get("source_id", 0),
-                    n.get("origin", "unknown"),
-                    n.get("created_at", ""),
-                ]
+        # A single writerows call iterates the rows in C instead of one writerow call per note.
+        writer.writerows(
+            (
+                n.get("type", "basic"),
+                n.get("front", ""),
+                n.get("back", ""),
+                n.get("cloze", ""),
+                n.get("extra", ""),
+                " ".join(n.get("tags", [])),
+                n.get("source_id", 0),
+                n.get("origin", "unknown"),
+                n.get("created_at", ""),
             )
+            for n in notes
+        )
     return out_path
 
 
@@ -1960,18 +2479,22 @@ def build_audit_jsonl(
     deck_name: str,
     notes: List[Dict[str, Any]],
     sources: List[Dict[str, Any]],
-    proposals: Optional[List[Dict[str, Any]]] = None,
-    feedback_log: Optional[List[Dict[str, Any]]] = None,
+    proposals: Optional[Iterable[Dict[str, Any]]] = None,
+    feedback_log: Optional[Iterable[Dict[str, Any]]] = None,
+    proposals_count: Optional[int] = None,
+    feedback_count: Optional[int] = None,
 ) -> str:
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    out_name = f"audit_user_{user_id}_{ts}.jsonl"
-    out_path = os.path.join(EXPORT_DIR, out_name)
-    source_by_id = {int(s["id"]): s for s in sources}
-    linked_source_ids = {int(n.get("source_id", 0)) for n in notes if int(n.get("source_id", 0)) > 0}
+    """Write the audit JSONL; proposals/feedback may be one-pass iterators if their counts are given."""
+    out_path = _export_path(f"audit_user_{user_id}", "jsonl")
+    # Source ids come straight from the INTEGER column; linked ids are collected while notes
+    # are written rather than in a separate pass over notes.
+    source_by_id = {s["id"]: s for s in sources}
+    linked_source_ids = set()
     proposals = proposals or []
     feedback_log = feedback_log or []
 
-    with open(out_path, "w", encoding="utf-8") as f:
+    # orjson emits UTF-8 bytes directly; a 1 MiB buffer turns per-record writes into few syscalls.
+    with open(out_path, "wb", buffering=1 << 20) as f:
         meta = {
             "record_type": "meta",
             "generated_at": datetime.utcnow().isoformat() + "Z",
@@ -1979,29 +2502,30 @@ def build_audit_jsonl(
             "deck_name": deck_name,
             "notes_count": len(notes),
             "sources_count": len(sources),
-            "proposals_count": len(proposals),
-            "proposal_feedback_count": len(feedback_log),
+            "proposals_count": len(proposals) if proposals_count is None else proposals_count,
+            "proposal_feedback_count": len(feedback_log) if feedback_count is None else feedback_count,
         }
-        f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+        f.write(_json_line(meta))
 
         for n in notes:
             sid = int(n.get("source_id", 0) or 0)
+            if sid > 0:
+                linked_source_ids.add(sid)
             record = {
                 "record_type": "note",
                 "note": n,
                 "source": source_by_id.get(sid),
             }
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(_json_line(record))
 
         for s in sources:
-            sid = int(s["id"])
-            if sid in linked_source_ids:
+            if s["id"] in linked_source_ids:
                 continue
             record = {
                 "record_type": "source_without_note",
                 "source": s,
             }
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(_json_line(record))
 
         for p in proposals:
             sid = int(p.get("source_id", 0) or 0)
@@ -2010,7 +2534,7 @@ def build_audit_jsonl(
                 "proposal": p,
                 "source": source_by_id.get(sid),
             }
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(_json_line(record))
 
         for fb in feedback_log:
             sid = int(fb.get("source_id", 0) or 0)
@@ -2019,22 +2543,98 @@ def build_audit_jsonl(
                 "feedback": fb,
                 "source": source_by_id.get(sid),
             }
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(_json_line(record))
     return out_path
 
 
+AUDIT_EXPORT_ROW_LIMIT = 100000
+
+
+def export_audit_bundle(user_id: int) -> Tuple[str, Dict[str, int]]:
+    """Build the audit JSONL for user_id; returns (path, record counts). Runs in a worker thread."""
+    with db_conn() as conn:
+        deck_name = get_deck_name(conn, user_id)  # may insert the user row, so before the snapshot
+        # One read snapshot, so the header counts match the proposal/feedback rows streamed below.
+        conn.execute("BEGIN")
+        notes = get_user_notes(conn, user_id)
+        # Every record embeds its source, so sources are kept in memory; proposals and feedback
+        # are only written out and stream straight from the cursor.
+        sources = get_user_sources(conn, user_id=user_id, limit=AUDIT_EXPORT_ROW_LIMIT, status=None)
+        row = conn.execute(
+            """
+            SELECT (SELECT COUNT(*) FROM note_proposals WHERE user_id=?),
+                   (SELECT COUNT(*) FROM proposal_feedback WHERE user_id=?)
+            """,
+            (user_id, user_id),
+        ).fetchone()
+        counts = {
+            "notes": len(notes),
+            "sources": len(sources),
+            "proposals": min(int(row[0]), AUDIT_EXPORT_ROW_LIMIT),
+            "feedback": min(int(row[1]), AUDIT_EXPORT_ROW_LIMIT),
+        }
+        path = build_audit_jsonl(
+            user_id,
+            deck_name,
+            notes,
+            sources,
+            proposals=iter_user_proposals(conn, user_id=user_id, limit=AUDIT_EXPORT_ROW_LIMIT),
+            feedback_log=iter_user_proposal_feedback(conn, user_id=user_id, limit=AUDIT_EXPORT_ROW_LIMIT),
+            proposals_count=counts["proposals"],
+            feedback_count=counts["feedback"],
+        )
+    return path, counts
+
+
 # -------------------------
 # Mochi API helpers (optional)
 # -------------------------
 MOCHI_BASE = "https://app.mochi.cards/api"
+# Concurrent Mochi requests per sync; pushes are round-trip bound, not CPU bound.
+MOCHI_SYNC_CONCURRENCY = 8
+mochi_client = httpx.AsyncClient(
+    base_url=MOCHI_BASE,
+    timeout=25,
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+)
+# Deck validation runs before every sync and approval push; reuse a recent deck listing
+# instead of re-downloading it each time. Short TTL so remotely trashed decks are noticed.
+MOCHI_DECK_CACHE_TTL_SEC = 60
+_mochi_deck_index: Dict[str, Tuple[float, Dict[str, Dict[str, Any]]]] = {}
 MOCHI_SEPARATOR_RE = re.compile(r"\n-{3,}\n")
+ANKI_CLOZE_RE = re.compile(r"\{\{c(\d+)::(.*?)\}\}")
+MOCHI_CLOZE_RE = re.compile(r"\{\{(\d+)::(.*?)\}\}")
+MOCHI_CLOZE_MARK_RE = re.compile(r"\{\{\d+::")
 
 
 def mochi_auth(key: str):
     return (key, "")  # HTTP Basic Auth: username=API key, no password
 
 
-def mochi_request(
+# Gateway errors are retried only for idempotent methods; a retried POST could create a card twice.
+MOCHI_RETRY_STATUSES = {502, 503, 504}
+MOCHI_IDEMPOTENT_METHODS = {"GET", "DELETE"}
+MOCHI_MAX_RETRY_DELAY_SEC = 30.0
+
+
+def _mochi_retry_delay(resp: httpx.Response, attempt: int, retry_sleep: float) -> float:
+    raw = (resp.headers.get("Retry-After") or "").strip()
+    delay: Optional[float] = None
+    if raw:
+        try:
+            delay = float(raw)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(raw).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+    if delay is None:
+        delay = retry_sleep * (2**attempt)
+    # Jitter keeps the concurrent sync calls throttled together from retrying in lockstep.
+    return min(max(0.0, delay) + random.uniform(0, retry_sleep / 2), MOCHI_MAX_RETRY_DELAY_SEC)
+
+
+async def mochi_request(
     method: str,
     key: str,
     path: str,
@@ -2043,43 +2643,56 @@ def mochi_request(
     retries: int = 4,
     retry_sleep: float = 0.6,
     **kwargs: Any,
-) -> requests.Response:
-    url = f"{MOCHI_BASE}{path}"
+) -> httpx.Response:
     for attempt in range(retries + 1):
-        resp = requests.request(method, url, auth=mochi_auth(key), timeout=25, **kwargs)
+        resp = await mochi_client.request(method, path, auth=mochi_auth(key), **kwargs)
         if resp.status_code // 100 == 2:
             return resp
         if allow_404 and resp.status_code == 404:
             return resp
-        if resp.status_code == 429 and attempt < retries:
-            time.sleep(retry_sleep * (attempt + 1))
+        retryable = resp.status_code == 429 or (
+            resp.status_code in MOCHI_RETRY_STATUSES and method in MOCHI_IDEMPOTENT_METHODS
+        )
+        if retryable and attempt < retries:
+            await asyncio.sleep(_mochi_retry_delay(resp, attempt, retry_sleep))
             continue
         resp.raise_for_status()
     return resp
 
 
-def mochi_list_templates(key: str) -> List[Dict[str, Any]]:
-    r = mochi_request("GET", key, "/templates/")
+async def mochi_list_templates(key: str) -> List[Dict[str, Any]]:
+    r = await mochi_request("GET", key, "/templates/")
     return r.json().get("docs", [])
 
 
-def mochi_list_decks(key: str) -> List[Dict[str, Any]]:
-    r = mochi_request("GET", key, "/decks/")
-    return r.json().get("docs", [])
+async def mochi_list_decks(key: str) -> List[Dict[str, Any]]:
+    r = await mochi_request("GET", key, "/decks/")
+    docs = r.json().get("docs", [])
+    _mochi_deck_index[key] = (time.monotonic(), {d.get("id"): d for d in reversed(docs)})
+    return docs
 
 
-def mochi_get_deck(key: str, deck_id: str) -> Optional[Dict[str, Any]]:
+async def mochi_get_deck(key: str, deck_id: str) -> Optional[Dict[str, Any]]:
     if not deck_id:
         return None
-    for d in mochi_list_decks(key):
-        if d.get("id") == deck_id:
-            return d
-    return None
+    cached = _mochi_deck_index.get(key)
+    if cached is not None and time.monotonic() - cached[0] <= MOCHI_DECK_CACHE_TTL_SEC:
+        deck = cached[1].get(deck_id)
+        if deck is not None:
+            return deck
+    # Expired, or a miss: the deck may have been created in Mochi since the last listing.
+    await mochi_list_decks(key)
+    return _mochi_deck_index[key][1].get(deck_id)
+
 
+def mochi_forget_decks(key: str):
+    # Drop the cached listing so the next validation re-reads decks from Mochi.
+    _mochi_deck_index.pop(key, None)
 
-def mochi_find_simple_template_id(key: str) -> Optional[str]:
+
+async def mochi_find_simple_template_id(key: str) -> Optional[str]:
     try:
-        docs = mochi_list_templates(key)
+        docs = await mochi_list_templates(key)
         for d in docs:
             if d.get("name") in {"Simple flashcard", "Basic Flashcard"}:
                 return d.get("id")
@@ -2088,41 +2701,35 @@ def mochi_find_simple_template_id(key: str) -> Optional[str]:
     return None
 
 
-def mochi_create_deck(key: str, name: str) -> str:
-    r = mochi_request(
+async def mochi_create_deck(key: str, name: str) -> str:
+    r = await mochi_request(
         "POST",
         key,
         "/decks/",
         json={"name": name},
     )
+    mochi_forget_decks(key)
     return r.json()["id"]
 
 
+# Template replacements run in C; the literal checks skip the regex for text without cloze markers.
 def anki_cloze_to_mochi(md: str) -> str:
-    pattern = re.compile(r"\{\{c(\d+)::(.*?)\}\}")
-    return pattern.sub(lambda m: "{{" + m.group(1) + "::" + m.group(2) + "}}", md)
+    return ANKI_CLOZE_RE.sub(r"{{\1::\2}}", md) if "{{c" in md else md
 
 
 def mochi_cloze_to_anki(md: str) -> str:
-    pattern = re.compile(r"\{\{(\d+)::(.*?)\}\}")
-    return pattern.sub(lambda m: "{{c" + m.group(1) + "::" + m.group(2) + "}}", md)
+    return MOCHI_CLOZE_RE.sub(r"{{c\1::\2}}", md) if "{{" in md else md
 
 
 def mochi_note_content(n: Dict[str, Any]) -> str:
-    if n["type"] == "cloze":
-        base = anki_cloze_to_mochi(n.get("cloze", ""))
-        extra = n.get("extra", "")
-        content = base
-        if extra:
-            content += f"\n\n---\n{extra}"
-        return content
-    front = n.get("front", "")
-    back = n.get("back", "")
+    # Each shape is built by a single f-string rather than a base string plus a += copy.
     extra = n.get("extra", "")
-    content = f"{front}\n\n---\n{back}"
+    if n["type"] == "cloze":
+        cloze = anki_cloze_to_mochi(n.get("cloze", ""))
+        return f"{cloze}\n\n---\n{extra}" if extra else cloze
     if extra:
-        content += f"\n\n{extra}"
-    return content
+        return f"{n.get('front', '')}\n\n---\n{n.get('back', '')}\n\n{extra}"
+    return f"{n.get('front', '')}\n\n---\n{n.get('back', '')}"
 
 
 def mochi_extract_tags(card: Dict[str, Any]) -> List[str]:
@@ -2142,6 +2749,9 @@ def mochi_extract_tags(card: Dict[str, Any]) -> List[str]:
 def mochi_split_content(content: str) -> Tuple[str, str]:
     if not content:
         return "", ""
+    # Every separator match contains "\n---"; most cards have none, so skip the regex.
+    if "\n---" not in content:
+        return content.strip(), ""
     m = MOCHI_SEPARATOR_RE.search(content)
     if not m:
         return content.strip(), ""
@@ -2168,7 +2778,7 @@ def mochi_card_to_local_note(card: Dict[str, Any]) -> Dict[str, Any]:
     left, right = mochi_split_content(content)
 
     cloze_zone = left if left else content
-    if "{{" in cloze_zone and re.search(r"\{\{\d+::", cloze_zone):
+    if "{{" in cloze_zone and "::" in cloze_zone and MOCHI_CLOZE_MARK_RE.search(cloze_zone):
         return {
             "type": "cloze",
             "front": "",
@@ -2208,24 +2818,24 @@ def mochi_card_to_local_note(card: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def mochi_create_card(key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    r = mochi_request("POST", key, "/cards/", json=payload)
+async def mochi_create_card(key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    r = await mochi_request("POST", key, "/cards/", json=payload)
     return r.json()
 
 
-def mochi_get_card(key: str, card_id: str) -> Optional[Dict[str, Any]]:
-    r = mochi_request("GET", key, f"/cards/{card_id}", allow_404=True)
+async def mochi_get_card(key: str, card_id: str) -> Optional[Dict[str, Any]]:
+    r = await mochi_request("GET", key, f"/cards/{card_id}", allow_404=True)
     if r.status_code == 404:
         return None
     return r.json()
 
 
-def mochi_delete_card(key: str, card_id: str) -> bool:
-    r = mochi_request("DELETE", key, f"/cards/{card_id}", allow_404=True)
+async def mochi_delete_card(key: str, card_id: str) -> bool:
+    r = await mochi_request("DELETE", key, f"/cards/{card_id}", allow_404=True)
     return r.status_code // 100 == 2
 
 
-def mochi_list_cards(key: str, deck_id: str, limit: int = MOCHI_SYNC_FETCH_LIMIT) -> List[Dict[str, Any]]:
+async def mochi_list_cards(key: str, deck_id: str, limit: int = MOCHI_SYNC_FETCH_LIMIT) -> List[Dict[str, Any]]:
     all_docs: List[Dict[str, Any]] = []
     bookmark: Optional[str] = None
     page_size = max(1, min(limit, 200))
@@ -2242,7 +2852,8 @@ def mochi_list_cards(key: str, deck_id: str, limit: int = MOCHI_SYNC_FETCH_LIMIT
         params: Dict[str, Any] = {"deck-id": deck_id, "limit": page_size}
         if bookmark and not _terminal_bookmark(bookmark):
             params["bookmark"] = bookmark
-        r = mochi_request("GET", key, "/cards/", params=params)
+        # Pages chain through the bookmark returned by the previous page, so they stay sequential.
+        r = await mochi_request("GET", key, "/cards/", params=params)
         payload = r.json()
         all_docs.extend(payload.get("docs", []))
         bookmark = payload.get("bookmark")
@@ -2252,7 +2863,26 @@ def mochi_list_cards(key: str, deck_id: str, limit: int = MOCHI_SYNC_FETCH_LIMIT
     return all_docs
 
 
-def sync_push_to_mochi(
+async def _gather_mochi_calls(calls: List[Awaitable[Any]]) -> List[Any]:
+    """Await calls with at most MOCHI_SYNC_CONCURRENCY in flight; failures come back as exceptions."""
+    sem = asyncio.Semaphore(MOCHI_SYNC_CONCURRENCY)
+
+    async def _bounded(call: Awaitable[Any]) -> Any:
+        async with sem:
+            return await call
+
+    return await asyncio.gather(*(_bounded(c) for c in calls), return_exceptions=True)
+
+
+def _mochi_card_payload(n: Dict[str, Any], deck_id: str) -> Dict[str, Any]:
+    return {
+        "content": mochi_note_content(n),
+        "deck-id": deck_id,
+        "manual-tags": list(n.get("tags", [])),
+    }
+
+
+async def sync_push_to_mochi(
     conn: sqlite3.Connection,
     user_id: int,
     key: str,
@@ -2272,88 +2902,93 @@ def sync_push_to_mochi(
         "local_changed_not_pushed": 0,
     }
 
+    # Linked cards are fetched, and missing cards created, MOCHI_SYNC_CONCURRENCY at a time.
+    # Links for every successful call are written before the first failure is re-raised, so
+    # a retried push doesn't create duplicate cards.
+    linked = [(int(n["id"]), link_by_note[int(n["id"])]) for n in notes if int(n["id"]) in link_by_note]
+    if len(linked) > 1:
+        # One paged deck listing (MOCHI_SYNC_FETCH_LIMIT cards per request) replaces a GET per
+        # linked card; a card missing from it is gone or in another deck, as the GET would report.
+        deck_cards = {c.get("id"): c for c in await mochi_list_cards(key, deck_id) if c.get("deck-id") == deck_id}
+        remote_by_note = {note_id: deck_cards.get(row["mochi_card_id"]) for note_id, row in linked}
+    else:
+        remotes = await _gather_mochi_calls([mochi_get_card(key, row["mochi_card_id"]) for _, row in linked])
+        remote_by_note = dict(zip((note_id for note_id, _ in linked), remotes))
+
+    link_rows: List[Tuple[int, str, str, str, str, str]] = []
+    to_create: List[Tuple[int, str, bool, Dict[str, Any]]] = []
+    errors: List[BaseException] = []
     for n in notes:
         note_id = int(n["id"])
         local_hash = note_hash(n)
         row = link_by_note.get(note_id)
 
         if row:
-            remote = mochi_get_card(key, row["mochi_card_id"])
+            remote = remote_by_note[note_id]
+            if isinstance(remote, BaseException):
+                errors.append(remote)
+                continue
             remote_deck = (remote or {}).get("deck-id", "") if remote else ""
             if remote is None or remote_deck != deck_id:
-                payload = {
-                    "content": mochi_note_content(n),
-                    "deck-id": deck_id,
-                    "manual-tags": [t for t in n.get("tags", [])],
-                }
-                created = mochi_create_card(key, payload)
-                link_mochi_sync(
-                    conn,
-                    user_id=user_id,
-                    note_id=note_id,
-                    mochi_card_id=created.get("id", ""),
-                    mochi_deck_id=deck_id,
-                    local_hash=local_hash,
-                    remote_hash=mochi_card_hash(created),
-                    remote_updated_at=mochi_card_updated_at(created),
-                )
-                result["recreated_missing_remote"] += 1
+                to_create.append((note_id, local_hash, True, _mochi_card_payload(n, deck_id)))
                 continue
 
-            if row.get("local_hash") and row["local_hash"] != local_hash:
+            if row.get("local_hash") and not stored_hash_matches(row["local_hash"], local_hash, note_hash_payload(n)):
                 result["local_changed_not_pushed"] += 1
                 local_hash_for_link = row["local_hash"]
             else:
                 local_hash_for_link = local_hash
 
-            link_mochi_sync(
-                conn,
-                user_id=user_id,
-                note_id=note_id,
-                mochi_card_id=row["mochi_card_id"],
-                mochi_deck_id=deck_id,
-                local_hash=local_hash_for_link,
-                remote_hash=mochi_card_hash(remote),
-                remote_updated_at=mochi_card_updated_at(remote),
+            link_rows.append(
+                (
+                    note_id,
+                    row["mochi_card_id"],
+                    deck_id,
+                    local_hash_for_link,
+                    mochi_card_hash(remote),
+                    mochi_card_updated_at(remote),
+                )
             )
             result["already_linked"] += 1
             continue
 
-        payload = {
-            "content": mochi_note_content(n),
-            "deck-id": deck_id,
-            "manual-tags": [t for t in n.get("tags", [])],
-        }
-        created = mochi_create_card(key, payload)
+        to_create.append((note_id, local_hash, False, _mochi_card_payload(n, deck_id)))
+
+    created_cards = await _gather_mochi_calls([mochi_create_card(key, payload) for *_, payload in to_create])
+    for (note_id, local_hash, recreated, _), created in zip(to_create, created_cards):
+        if isinstance(created, BaseException):
+            errors.append(created)
+            continue
         card_id = created.get("id", "")
-        if not card_id:
+        if not card_id and not recreated:
             result["skipped"] += 1
             continue
-        link_mochi_sync(
-            conn,
-            user_id=user_id,
-            note_id=note_id,
-            mochi_card_id=card_id,
-            mochi_deck_id=deck_id,
-            local_hash=local_hash,
-            remote_hash=mochi_card_hash(created),
-            remote_updated_at=mochi_card_updated_at(created),
+        link_rows.append(
+            (note_id, card_id, deck_id, local_hash, mochi_card_hash(created), mochi_card_updated_at(created))
         )
-        result["created"] += 1
+        result["recreated_missing_remote" if recreated else "created"] += 1
 
+    link_mochi_sync_batch(conn, user_id, link_rows)
+    if errors:
+        raise errors[0]
     return result
 
 
-def sync_pull_from_mochi(
+async def sync_pull_from_mochi(
     conn: sqlite3.Connection,
     user_id: int,
     key: str,
     deck_id: str,
 ) -> Dict[str, Any]:
-    cards = mochi_list_cards(key, deck_id)
+    cards = await mochi_list_cards(key, deck_id)
     links = get_mochi_sync_rows(conn, user_id)
     link_by_card = {r["mochi_card_id"]: r for r in links}
+    # One query for every local note instead of a get_note_by_id per linked card.
+    note_by_id = {n["id"]: n for n in get_user_notes(conn, user_id)}
     seen_card_ids = set()
+    link_rows: List[Tuple[int, str, str, str, str, str]] = []
+    note_updates: List[Tuple[int, str, str, str, str, str, List[str]]] = []
+    removed_card_ids: List[str] = []
 
     result = {
         "remote_cards": len(cards),
@@ -2363,6 +2998,9 @@ def sync_pull_from_mochi(
         "removed_stale_links": 0,
     }
 
+    # Cards are fetched up front, so the loop below is DB-only: write it as one transaction
+    # instead of a commit per source/note/link row. Note updates, link removals and link
+    # upserts are collected and flushed with executemany after the loop.
     for card in cards:
         card_id = (card.get("id") or "").strip()
         if not card_id:
@@ -2376,39 +3014,30 @@ def sync_pull_from_mochi(
         link = link_by_card.get(card_id)
 
         if link:
-            note = get_note_by_id(conn, user_id, int(link["note_id"]))
+            note = note_by_id.get(int(link["note_id"]))
             if not note:
-                remove_mochi_sync_by_card(conn, user_id, card_id)
+                # Drop the dangling link and re-import the card as a new note below.
+                removed_card_ids.append(card_id)
             else:
-                if link.get("remote_hash") != remote_hash:
-                    update_note_fields(
-                        conn,
-                        user_id=user_id,
-                        note_id=int(note["id"]),
-                        note_type=parsed["type"],
-                        front=parsed.get("front", ""),
-                        back=parsed.get("back", ""),
-                        cloze=parsed.get("cloze", ""),
-                        extra=parsed.get("extra", ""),
-                        tags=parsed.get("tags", []),
-                        origin="mochi_pull",
+                if not stored_hash_matches(link.get("remote_hash") or "", remote_hash, mochi_card_hash_payload(card)):
+                    note_updates.append(
+                        (
+                            int(note["id"]),
+                            parsed["type"],
+                            parsed.get("front", ""),
+                            parsed.get("back", ""),
+                            parsed.get("cloze", ""),
+                            parsed.get("extra", ""),
+                            parsed.get("tags", []),
+                        )
                     )
-                    note = get_note_by_id(conn, user_id, int(note["id"]))
+                    # note_hash covers exactly the fields just written, so hash them directly.
+                    note = parsed
                     result["updated_local"] += 1
                 else:
                     result["unchanged"] += 1
 
-                if note:
-                    link_mochi_sync(
-                        conn,
-                        user_id=user_id,
-                        note_id=int(note["id"]),
-                        mochi_card_id=card_id,
-                        mochi_deck_id=deck_id,
-                        local_hash=note_hash(note),
-                        remote_hash=remote_hash,
-                        remote_updated_at=remote_updated_at,
-                    )
+                link_rows.append((int(link["note_id"]), card_id, deck_id, note_hash(note), remote_hash, remote_updated_at))
                 continue
 
         source_id = add_source(
@@ -2420,6 +3049,7 @@ def sync_pull_from_mochi(
             url=f"mochi://card/{card_id}",
             meta={"mochi_card_id": card_id, "mochi_deck_id": deck_id},
             status="processed",
+            commit=False,
         )
         note_id = add_note(
             conn,
@@ -2432,18 +3062,10 @@ def sync_pull_from_mochi(
             tags=parsed.get("tags", []),
             source_id=source_id,
             origin="mochi_pull",
+            commit=False,
         )
-        note = get_note_by_id(conn, user_id, note_id)
-        link_mochi_sync(
-            conn,
-            user_id=user_id,
-            note_id=note_id,
-            mochi_card_id=card_id,
-            mochi_deck_id=deck_id,
-            local_hash=note_hash(note or parsed),
-            remote_hash=remote_hash,
-            remote_updated_at=remote_updated_at,
-        )
+        # add_note stores the parsed fields as-is (tags normalized, as note_hash does too).
+        link_rows.append((note_id, card_id, deck_id, note_hash(parsed), remote_hash, remote_updated_at))
         result["created_local"] += 1
 
     for link in links:
@@ -2451,24 +3073,29 @@ def sync_pull_from_mochi(
             continue
         if link["mochi_card_id"] in seen_card_ids:
             continue
-        remove_mochi_sync_by_card(conn, user_id, link["mochi_card_id"])
+        removed_card_ids.append(link["mochi_card_id"])
         result["removed_stale_links"] += 1
 
+    # Removals go first: a dangling link's card is re-linked to its new note in link_rows.
+    remove_mochi_sync_by_cards(conn, user_id, removed_card_ids, commit=False)
+    update_note_fields_batch(conn, user_id, note_updates, origin="mochi_pull", commit=False)
+    link_mochi_sync_batch(conn, user_id, link_rows, commit=False)
+    conn.commit()
     return result
 
 
-def sync_mochi_both(
+async def sync_mochi_both(
     conn: sqlite3.Connection,
     user_id: int,
     key: str,
     deck_id: str,
 ) -> Dict[str, Any]:
-    push = sync_push_to_mochi(conn, user_id, key, deck_id)
-    pull = sync_pull_from_mochi(conn, user_id, key, deck_id)
+    push = await sync_push_to_mochi(conn, user_id, key, deck_id)
+    pull = await sync_pull_from_mochi(conn, user_id, key, deck_id)
     return {"push": push, "pull": pull}
 
 
-def repair_mochi_cards_from_local(
+async def repair_mochi_cards_from_local(
     conn: sqlite3.Connection,
     user_id: int,
     key: str,
@@ -2481,6 +3108,7 @@ def repair_mochi_cards_from_local(
         "missing_local_note": 0,
         "failed_create": 0,
     }
+    to_repair: List[Tuple[Dict[str, Any], str]] = []
     for row in links:
         if row.get("mochi_deck_id") != deck_id:
             continue
@@ -2489,33 +3117,34 @@ def repair_mochi_cards_from_local(
         if not note:
             result["missing_local_note"] += 1
             continue
+        to_repair.append((note, row.get("mochi_card_id", "")))
 
-        old_card_id = row.get("mochi_card_id", "")
+    async def _repair_one(note: Dict[str, Any], old_card_id: str) -> Dict[str, Any]:
         if old_card_id:
-            mochi_delete_card(key, old_card_id)
-
-        payload = {
-            "content": mochi_note_content(note),
-            "deck-id": deck_id,
-            "manual-tags": [t for t in note.get("tags", [])],
-        }
-        created = mochi_create_card(key, payload)
+            await mochi_delete_card(key, old_card_id)
+        return await mochi_create_card(key, _mochi_card_payload(note, deck_id))
+
+    # Links are independent delete+create pairs; run them concurrently like push does and
+    # store every new link before re-raising the first failure.
+    created_cards = await _gather_mochi_calls([_repair_one(note, old_card_id) for note, old_card_id in to_repair])
+    link_rows: List[Tuple[int, str, str, str, str, str]] = []
+    errors: List[BaseException] = []
+    for (note, _), created in zip(to_repair, created_cards):
+        if isinstance(created, BaseException):
+            errors.append(created)
+            continue
         new_card_id = created.get("id", "")
         if not new_card_id:
             result["failed_create"] += 1
             continue
-
-        link_mochi_sync(
-            conn,
-            user_id=user_id,
-            note_id=int(note["id"]),
-            mochi_card_id=new_card_id,
-            mochi_deck_id=deck_id,
-            local_hash=note_hash(note),
-            remote_hash=mochi_card_hash(created),
-            remote_updated_at=mochi_card_updated_at(created),
+        link_rows.append(
+            (int(note["id"]), new_card_id, deck_id, note_hash(note), mochi_card_hash(created), mochi_card_updated_at(created))
         )
         result["recreated"] += 1
+
+    link_mochi_sync_batch(conn, user_id, link_rows)
+    if errors:
+        raise errors[0]
     return result
 
 
@@ -2557,7 +3186,7 @@ HELP_TEXT = (
 )
 
 
-def _reaction_emojis(items: List[Any]) -> set[str]:
+def _reaction_emojis(items: Iterable[Any]) -> set[str]:
     out: set[str] = set()
     for it in items:
         if isinstance(it, ReactionTypeEmoji):
@@ -2569,6 +3198,40 @@ def _reaction_emojis(items: List[Any]) -> set[str]:
     return out
 
 
+# Telegram shows a chat action for ~5 s (or until the next bot message); don't re-send it sooner.
+CHAT_ACTION_REFRESH_SEC = 4.0
+# Above this many tracked (chat, action) pairs, entries past the refresh window are dropped.
+CHAT_ACTION_TRACKED_MAX = 256
+_chat_action_sent: Dict[Tuple[int, str], float] = {}
+_chat_action_tasks: set = set()
+
+
+def _show_chat_action(update: Update, action: str):
+    """Start a typing/upload indicator without waiting for the API call; repeats within a few seconds are skipped.
+
+    Only call this before slow work: the request may reach Telegram after a quick reply and linger for ~5 s.
+    """
+    chat = update.message.chat
+    key = (chat.id, action)
+    now = time.monotonic()
+    if now - _chat_action_sent.get(key, -CHAT_ACTION_REFRESH_SEC) < CHAT_ACTION_REFRESH_SEC:
+        return
+    _chat_action_sent[key] = now
+    if len(_chat_action_sent) > CHAT_ACTION_TRACKED_MAX:
+        for stale in [k for k, sent in _chat_action_sent.items() if now - sent >= CHAT_ACTION_REFRESH_SEC]:
+            del _chat_action_sent[stale]
+    task = asyncio.ensure_future(chat.send_action(action))
+    # Keep a reference until done; a failed indicator is cosmetic and must not fail the handler.
+    _chat_action_tasks.add(task)
+    task.add_done_callback(_chat_action_done)
+
+
+def _chat_action_done(task: "asyncio.Future[Any]"):
+    _chat_action_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("send_action failed: %s", task.exception())
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.effective_user is not None
     user_id = update.effective_user.id
@@ -2590,9 +3253,7 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.effective_user is not None
     user_id = update.effective_user.id
     with db_conn() as conn:
-        note_count = count_user_notes(conn, user_id)
-        pending = pending_source_count(conn, user_id)
-        deck_name = get_deck_name(conn, user_id)
+        note_count, pending, deck_name = get_user_status_summary(conn, user_id)
     await update.message.reply_text(
         f"Card backend: {card_backend_label(CARD_GENERATION_BACKEND)}\n"
         f"Proposal backend: {proposal_backend_label(PROPOSAL_GENERATION_BACKEND)}\n"
@@ -2757,11 +3418,19 @@ def _extract_proposal_text_from_message(msg: Any) -> str:
     return ""
 
 
-def _extract_feedback_text(raw_text: str) -> str:
-    m = PROPOSAL_FEEDBACK_RE.match(raw_text or "")
-    if not m:
-        return ""
-    return (m.group(1) or "").strip()
+async def _generate_proposals_for_text(text: str, feedback: str = "") -> Tuple[List[Dict[str, Any]], str, str]:
+    """Return (notes, engine, lang); engine is "empty_input" when no text is left after clipping."""
+    proposal_lang, proposal_text, proposal_feedback = resolve_proposal_language(text, feedback, ANKI_LANG)
+    clipped = proposal_text[:MAX_SOURCE_TEXT_CHARS].strip()
+    if not clipped:
+        return [], "empty_input", proposal_lang
+    notes, engine = await generate_proposal_notes(
+        clipped,
+        proposal_lang,
+        PROPOSAL_MAX_NOTES,
+        feedback=proposal_feedback,
+    )
+    return notes, engine, proposal_lang
 
 
 async def _create_and_send_proposals(
@@ -2776,21 +3445,28 @@ async def _create_and_send_proposals(
     revision_index: int = 0,
     feedback_id: int = 0,
     announce_result: bool = True,
+    generated: Optional[Tuple[List[Dict[str, Any]], str, str]] = None,
 ) -> Tuple[int, str]:
     assert update.message is not None
-    proposal_lang, proposal_text, proposal_feedback = resolve_proposal_language(text, feedback, ANKI_LANG)
-    clipped = proposal_text[:MAX_SOURCE_TEXT_CHARS].strip()
-    if not clipped:
+    if source_id > 0 and not feedback and not replace_pending_source_proposals:
+        # Re-running /propose_source on an undecided source would only duplicate the open proposals.
+        with db_conn() as conn:
+            pending_ids = get_pending_proposal_ids_for_source(conn, user_id=user_id, source_id=source_id)
+        if pending_ids:
+            if announce_result:
+                await update.message.reply_text(
+                    f"Source #{source_id} already has pending proposal(s) "
+                    f"{', '.join(f'#{pid}' for pid in pending_ids)}. "
+                    "React to those messages with 👍/✅ or 👎/❌, or reply to one with feedback to regenerate."
+                )
+            return 0, "already_pending"
+    # Callers that generated up front (e.g. concurrently) pass the _generate_proposals_for_text result.
+    notes, engine, proposal_lang = generated or await _generate_proposals_for_text(text, feedback)
+    if engine == "empty_input":
         if announce_result:
             await update.message.reply_text("No text was available to generate proposals.")
         return 0, "empty_input"
 
-    notes, engine = generate_proposal_notes(
-        clipped,
-        proposal_lang,
-        PROPOSAL_MAX_NOTES,
-        feedback=proposal_feedback,
-    )
     if not notes:
         if announce_result:
             await update.message.reply_text(
@@ -2803,28 +3479,32 @@ async def _create_and_send_proposals(
 
     with db_conn() as conn:
         if replace_pending_source_proposals and source_id > 0:
-            expire_pending_proposals_for_source(conn, user_id=user_id, source_id=source_id)
-        proposal_ids: List[int] = []
-        for n in notes[: max(1, PROPOSAL_MAX_NOTES)]:
-            pid = add_note_proposal(
-                conn,
-                user_id=user_id,
-                source_id=source_id,
-                note=n,
-                telegram_message_id=0,
-                parent_proposal_id=parent_proposal_id,
-                root_proposal_id=root_proposal_id,
-                revision_index=revision_index,
-                feedback_id=feedback_id,
-            )
-            proposal_ids.append(pid)
+            expire_pending_proposals_for_source(conn, user_id=user_id, source_id=source_id, commit=False)
+        # Expiring the old revision, the new proposals and the source status change land in a single commit.
+        proposal_ids = add_note_proposals_batch(
+            conn,
+            user_id=user_id,
+            source_id=source_id,
+            notes=notes[: max(1, PROPOSAL_MAX_NOTES)],
+            parent_proposal_id=parent_proposal_id,
+            root_proposal_id=root_proposal_id,
+            revision_index=revision_index,
+            feedback_id=feedback_id,
+            commit=False,
+        )
         if source_id > 0:
             set_source_status(conn, user_id, source_id, "processed")
 
-    for pid, note in zip(proposal_ids, notes[: len(proposal_ids)]):
-        sent = await update.message.reply_text(format_proposal_message(pid, note))
+    # Updates are handled one at a time, so no reaction can arrive before this handler links
+    # the messages; write all links in one commit (also after a failed send).
+    message_links: List[Tuple[int, int]] = []
+    try:
+        for pid, note in zip(proposal_ids, notes[: len(proposal_ids)]):
+            sent = await update.message.reply_text(format_proposal_message(pid, note))
+            message_links.append((pid, sent.message_id))
+    finally:
         with db_conn() as conn:
-            set_note_proposal_message_id(conn, user_id=user_id, proposal_id=pid, message_id=sent.message_id)
+            set_note_proposal_message_ids(conn, user_id=user_id, links=message_links)
 
     if announce_result:
         source_bit = f" from source #{source_id}" if source_id > 0 else ""
@@ -2855,7 +3535,7 @@ async def _handle_proposal_feedback(
             if strict:
                 await update.message.reply_text("Reply to a pending proposal message when sending feedback.")
             return strict
-        source_id = int(proposal.get("source_id", 0) or 0)
+        source_id = proposal["source_id"]
         if source_id <= 0:
             await update.message.reply_text("That proposal is not linked to a source, so it cannot be revised.")
             return True
@@ -2864,7 +3544,7 @@ async def _handle_proposal_feedback(
             conn,
             user_id=user_id,
             source_id=source_id,
-            target_proposal_id=int(proposal.get("id", 0) or 0),
+            target_proposal_id=proposal["id"],
             feedback_text=feedback,
             requested_lang=requested_lang,
             telegram_message_id=int(update.message.message_id or 0),
@@ -2887,9 +3567,9 @@ async def _handle_proposal_feedback(
         text=source_text,
         feedback=feedback,
         replace_pending_source_proposals=True,
-        parent_proposal_id=int(proposal.get("id", 0) or 0),
-        root_proposal_id=int(proposal.get("root_proposal_id", 0) or 0) or int(proposal.get("id", 0) or 0),
-        revision_index=int(proposal.get("revision_index", 0) or 0) + 1,
+        parent_proposal_id=proposal["id"],
+        root_proposal_id=proposal["root_proposal_id"] or proposal["id"],
+        revision_index=proposal["revision_index"] + 1,
         feedback_id=feedback_id,
         announce_result=False,
     )
@@ -2918,6 +3598,9 @@ async def propose_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not raw:
         await update.message.reply_text("Usage: /propose <text> (or reply to a text message with /propose)")
         return
+    # Clip once: the later [:MAX_SOURCE_TEXT_CHARS] slices then return this same string without copying,
+    # and the first generation sees the same text that feedback revisions read back from the source.
+    raw = raw[:MAX_SOURCE_TEXT_CHARS]
 
     with db_conn() as conn:
         source_id = add_source(
@@ -2925,7 +3608,7 @@ async def propose_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_id=user_id,
             source_type="proposal_text",
             source_label=raw[:120],
-            content_text=raw[:MAX_SOURCE_TEXT_CHARS],
+            content_text=raw,
             meta={"transport": "propose_cmd"},
             status="pending",
         )
@@ -2992,6 +3675,12 @@ async def propose_pending_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     with db_conn() as conn:
         pending = get_pending_text_sources(conn, user_id=user_id, limit=limit)
+        # Sources with undecided proposals are skipped before generation so no LLM call is spent on them.
+        to_generate = [
+            source
+            for source in pending
+            if not get_pending_proposal_ids_for_source(conn, user_id=user_id, source_id=int(source["id"]))
+        ]
     if not pending:
         await update.message.reply_text("No pending text sources found. Use /queue to inspect pending sources.")
         return
@@ -2999,20 +3688,39 @@ async def propose_pending_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
     posted_sources = 0
     posted_proposals = 0
     failed_sources = 0
+    skipped_sources = len(pending) - len(to_generate)
     engines: List[str] = []
 
-    for source in pending:
-        text = (source.get("content_text") or "").strip()
-        if not text:
+    sem = asyncio.Semaphore(max(1, PROPOSE_PENDING_CONCURRENCY))
+
+    async def _generate(text: str) -> Tuple[List[Dict[str, Any]], str, str]:
+        async with sem:
+            return await _generate_proposals_for_text(text)
+
+    # LLM generation dominates, so run it for all sources at once; proposals are posted once every
+    # generation has finished, source by source, so chat messages stay grouped and sends stay sequential.
+    # A failure for one source is counted and must not drop the proposals generated for the others.
+    results = await asyncio.gather(
+        *(_generate((source.get("content_text") or "").strip()) for source in to_generate),
+        return_exceptions=True,
+    )
+    for source, result in zip(to_generate, results):
+        if isinstance(result, BaseException):
+            logger.error("Proposal generation failed for source #%s", source["id"], exc_info=result)
             failed_sources += 1
             continue
         n, engine = await _create_and_send_proposals(
             update,
             user_id=user_id,
             source_id=int(source["id"]),
-            text=text,
+            text=(source.get("content_text") or "").strip(),
             announce_result=False,
+            generated=result,
         )
+        if engine == "already_pending":
+            # Proposals were posted for this source (e.g. by /propose_source) while this batch was generating.
+            skipped_sources += 1
+            continue
         engines.append(engine)
         if n > 0:
             posted_sources += 1
@@ -3027,6 +3735,7 @@ async def propose_pending_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"Sources with proposals: {posted_sources}\n"
         f"Proposals posted: {posted_proposals}\n"
         f"Sources without proposals: {failed_sources}\n"
+        f"Sources skipped (pending proposals): {skipped_sources}\n"
         f"Engine results: {engine_summary}"
     )
 
@@ -3036,8 +3745,12 @@ async def handle_proposal_reaction(update: Update, context: ContextTypes.DEFAULT
     if reaction is None or reaction.user is None:
         return
 
+    # Removing a reaction sends an empty new_reaction; nothing was added.
+    if not reaction.new_reaction:
+        return
+
     user_id = reaction.user.id
-    added = _reaction_emojis(list(reaction.new_reaction)) - _reaction_emojis(list(reaction.old_reaction))
+    added = _reaction_emojis(reaction.new_reaction) - _reaction_emojis(reaction.old_reaction)
     if not added:
         return
 
@@ -3065,9 +3778,11 @@ async def handle_proposal_reaction(update: Update, context: ContextTypes.DEFAULT
             cloze=proposal.get("cloze", ""),
             extra=proposal.get("extra", ""),
             tags=proposal.get("tags", []),
-            source_id=int(proposal.get("source_id", 0) or 0),
+            source_id=proposal["source_id"],
             origin="proposal_approved",
+            commit=False,
         )
+        # The note and the approval commit together.
         set_proposal_decision(conn, user_id=user_id, proposal_id=proposal["id"], status="approved", note_id=note_id)
         note = get_note_by_id(conn, user_id=user_id, note_id=note_id)
         user = get_user_row(conn, user_id)
@@ -3079,7 +3794,7 @@ async def handle_proposal_reaction(update: Update, context: ContextTypes.DEFAULT
                 text=f"Approved proposal #{proposal['id']} as note #{note_id}. Saved locally only ({missing})",
             )
             return
-        deck_check = _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
+        deck_check = await _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
         if deck_check:
             await context.bot.send_message(
                 chat_id=reaction.chat.id,
@@ -3088,7 +3803,7 @@ async def handle_proposal_reaction(update: Update, context: ContextTypes.DEFAULT
             return
 
         try:
-            sync_res = sync_push_to_mochi(
+            sync_res = await sync_push_to_mochi(
                 conn,
                 user_id=user_id,
                 key=user["mochi_api_key"],
@@ -3101,12 +3816,22 @@ async def handle_proposal_reaction(update: Update, context: ContextTypes.DEFAULT
             )
         except Exception as e:
             logger.exception("Proposal approval sync failed: %s", e)
+            mochi_forget_decks(user["mochi_api_key"])
             await context.bot.send_message(
                 chat_id=reaction.chat.id,
                 text=f"Approved proposal #{proposal['id']} as note #{note_id}, but Mochi sync failed.",
             )
 
 
+async def _reply_with_export(update: Update, path: str, caption: str):
+    # InputFile would read() a file object on the event loop; hand it the bytes read in a thread instead.
+    data = await asyncio.to_thread(Path(path).read_bytes)
+    await update.message.reply_document(
+        document=InputFile(data, filename=os.path.basename(path)),
+        caption=caption,
+    )
+
+
 async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.effective_user is not None
     user_id = update.effective_user.id
@@ -3116,13 +3841,10 @@ async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not notes:
         await update.message.reply_text("No cards to export yet.")
         return
-    await update.message.chat.send_action(ChatAction.UPLOAD_DOCUMENT)
-    path = build_apkg(user_id, deck_name, notes)
-    with open(path, "rb") as f:
-        await update.message.reply_document(
-            document=InputFile(f, filename=os.path.basename(path)),
-            caption=f"Deck: {deck_name} - {len(notes)} cards",
-        )
+    _show_chat_action(update, ChatAction.UPLOAD_DOCUMENT)
+    # genanki packaging (GUID hashing, SQLite, zip) is CPU-bound; keep it off the event loop.
+    path = await asyncio.to_thread(build_apkg, user_id, deck_name, notes)
+    await _reply_with_export(update, path, f"Deck: {deck_name} - {len(notes)} cards")
 
 
 async def export_csv_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3134,34 +3856,22 @@ async def export_csv_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not notes:
         await update.message.reply_text("No cards to export yet.")
         return
-    await update.message.chat.send_action(ChatAction.UPLOAD_DOCUMENT)
-    path = build_csv(user_id, deck_name, notes)
-    with open(path, "rb") as f:
-        await update.message.reply_document(
-            document=InputFile(f, filename=os.path.basename(path)),
-            caption=f"CSV for: {deck_name} - {len(notes)} cards",
-        )
+    _show_chat_action(update, ChatAction.UPLOAD_DOCUMENT)
+    path = await asyncio.to_thread(build_csv, user_id, deck_name, notes)
+    await _reply_with_export(update, path, f"CSV for: {deck_name} - {len(notes)} cards")
 
 
 async def export_audit_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.effective_user is not None
     user_id = update.effective_user.id
-    with db_conn() as conn:
-        deck_name = get_deck_name(conn, user_id)
-        notes = get_user_notes(conn, user_id)
-        sources = get_user_sources(conn, user_id=user_id, limit=100000, status=None)
-        proposals = get_user_proposals(conn, user_id=user_id, limit=100000)
-        feedback_log = get_user_proposal_feedback(conn, user_id=user_id, limit=100000)
-    await update.message.chat.send_action(ChatAction.UPLOAD_DOCUMENT)
-    path = build_audit_jsonl(user_id, deck_name, notes, sources, proposals=proposals, feedback_log=feedback_log)
-    with open(path, "rb") as f:
-        await update.message.reply_document(
-            document=InputFile(f, filename=os.path.basename(path)),
-            caption=(
-                f"Audit bundle: {len(notes)} notes, {len(sources)} sources, "
-                f"{len(proposals)} proposals, {len(feedback_log)} feedback entries"
-            ),
-        )
+    _show_chat_action(update, ChatAction.UPLOAD_DOCUMENT)
+    path, counts = await asyncio.to_thread(export_audit_bundle, user_id)
+    await _reply_with_export(
+        update,
+        path,
+        f"Audit bundle: {counts['notes']} notes, {counts['sources']} sources, "
+        f"{counts['proposals']} proposals, {counts['feedback']} feedback entries",
+    )
 
 
 def _require_mochi_credentials(user: Dict[str, Any]) -> Optional[str]:
@@ -3188,9 +3898,9 @@ def _fmt_pull_result(res: Dict[str, Any]) -> str:
     )
 
 
-def _validate_selected_mochi_deck(key: str, deck_id: str) -> Optional[str]:
+async def _validate_selected_mochi_deck(key: str, deck_id: str) -> Optional[str]:
     try:
-        deck = mochi_get_deck(key, deck_id)
+        deck = await mochi_get_deck(key, deck_id)
     except Exception as e:
         logger.exception("Could not validate Mochi deck: %s", e)
         return "Could not validate Mochi deck. Try /mochi_decks and pick a valid deck id."
@@ -3218,20 +3928,21 @@ async def sync_mochi_push_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
     if missing:
         await update.message.reply_text(missing)
         return
-    deck_check = _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
+    deck_check = await _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
     if deck_check:
         await update.message.reply_text(deck_check)
         return
-    backup_path = snapshot_db_backup(user_id, "mochi_push")
-    await update.message.chat.send_action(ChatAction.TYPING)
+    backup_path = await asyncio.to_thread(snapshot_db_backup, user_id, "mochi_push")
+    _show_chat_action(update, ChatAction.TYPING)
     try:
         with db_conn() as conn:
-            result = sync_push_to_mochi(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
+            result = await sync_push_to_mochi(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
         await update.message.reply_text(
             f"{_fmt_push_result(result)}\nDeck: {user['mochi_deck_id']}\nBackup: {os.path.basename(backup_path)}"
         )
     except Exception as e:
         logger.exception("Mochi push sync failed: %s", e)
+        mochi_forget_decks(user["mochi_api_key"])
         await update.message.reply_text("Mochi push sync failed. Check key/deck and try again.")
 
 
@@ -3244,20 +3955,21 @@ async def sync_mochi_pull_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
     if missing:
         await update.message.reply_text(missing)
         return
-    deck_check = _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
+    deck_check = await _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
     if deck_check:
         await update.message.reply_text(deck_check)
         return
-    backup_path = snapshot_db_backup(user_id, "mochi_pull")
-    await update.message.chat.send_action(ChatAction.TYPING)
+    backup_path = await asyncio.to_thread(snapshot_db_backup, user_id, "mochi_pull")
+    _show_chat_action(update, ChatAction.TYPING)
     try:
         with db_conn() as conn:
-            result = sync_pull_from_mochi(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
+            result = await sync_pull_from_mochi(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
         await update.message.reply_text(
             f"{_fmt_pull_result(result)}\nDeck: {user['mochi_deck_id']}\nBackup: {os.path.basename(backup_path)}"
         )
     except Exception as e:
         logger.exception("Mochi pull sync failed: %s", e)
+        mochi_forget_decks(user["mochi_api_key"])
         await update.message.reply_text("Mochi pull sync failed. Check key/deck and try again.")
 
 
@@ -3270,21 +3982,22 @@ async def sync_mochi_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if missing:
         await update.message.reply_text(missing)
         return
-    deck_check = _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
+    deck_check = await _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
     if deck_check:
         await update.message.reply_text(deck_check)
         return
-    backup_path = snapshot_db_backup(user_id, "mochi_2way")
-    await update.message.chat.send_action(ChatAction.TYPING)
+    backup_path = await asyncio.to_thread(snapshot_db_backup, user_id, "mochi_2way")
+    _show_chat_action(update, ChatAction.TYPING)
     try:
         with db_conn() as conn:
-            result = sync_mochi_both(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
+            result = await sync_mochi_both(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
         await update.message.reply_text(
             f"{_fmt_push_result(result['push'])}\n{_fmt_pull_result(result['pull'])}\n"
             f"Deck: {user['mochi_deck_id']}\nBackup: {os.path.basename(backup_path)}"
         )
     except Exception as e:
         logger.exception("Mochi 2-way sync failed: %s", e)
+        mochi_forget_decks(user["mochi_api_key"])
         await update.message.reply_text("Mochi 2-way sync failed. Check key/deck and try again.")
 
 
@@ -3297,15 +4010,15 @@ async def mochi_repair_cards_cmd(update: Update, context: ContextTypes.DEFAULT_T
     if missing:
         await update.message.reply_text(missing)
         return
-    deck_check = _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
+    deck_check = await _validate_selected_mochi_deck(user["mochi_api_key"], user["mochi_deck_id"])
     if deck_check:
         await update.message.reply_text(deck_check)
         return
-    backup_path = snapshot_db_backup(user_id, "mochi_repair")
-    await update.message.chat.send_action(ChatAction.TYPING)
+    backup_path = await asyncio.to_thread(snapshot_db_backup, user_id, "mochi_repair")
+    _show_chat_action(update, ChatAction.TYPING)
     try:
         with db_conn() as conn:
-            result = repair_mochi_cards_from_local(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
+            result = await repair_mochi_cards_from_local(conn, user_id, user["mochi_api_key"], user["mochi_deck_id"])
         await update.message.reply_text(
             "Repaired linked Mochi cards.\n"
             f"checked_links={result['checked_links']}, recreated={result['recreated']}, "
@@ -3314,6 +4027,7 @@ async def mochi_repair_cards_cmd(update: Update, context: ContextTypes.DEFAULT_T
         )
     except Exception as e:
         logger.exception("Mochi card repair failed: %s", e)
+        mochi_forget_decks(user["mochi_api_key"])
         await update.message.reply_text("Mochi card repair failed. Check key/deck and try again.")
 
 
@@ -3338,7 +4052,7 @@ async def mochi_decks_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Set API key first: /mochi_setkey <api_key> (or MOCHI_API_KEY in .env).")
         return
     try:
-        docs = mochi_list_decks(user["mochi_api_key"])
+        docs = await mochi_list_decks(user["mochi_api_key"])
     except Exception as e:
         logger.exception("Mochi list decks failed: %s", e)
         await update.message.reply_text("Could not fetch decks from Mochi.")
@@ -3346,12 +4060,8 @@ async def mochi_decks_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not docs:
         await update.message.reply_text("No Mochi decks found.")
         return
-    lines = []
-    for d in docs[:25]:
-        did = d.get("id", "?")
-        name = (d.get("name") or "(unnamed)").strip()
-        lines.append(f"{name} -> {did}")
-    await update.message.reply_text("Mochi decks:\n" + "\n".join(lines))
+    body = "\n".join(f"{(d.get('name') or '(unnamed)').strip()} -> {d.get('id', '?')}" for d in docs[:25])
+    await update.message.reply_text("Mochi decks:\n" + body)
 
 
 async def mochi_createdeck_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3367,7 +4077,7 @@ async def mochi_createdeck_cmd(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("Set your API key first: /mochi_setkey <api_key>")
         return
     try:
-        deck_id = mochi_create_deck(user["mochi_api_key"], name)
+        deck_id = await mochi_create_deck(user["mochi_api_key"], name)
         with db_conn() as conn:
             set_mochi_deck_id(conn, user_id, deck_id)
         await update.message.reply_text(f"Created Mochi deck '{name}' with id: {deck_id}")
@@ -3410,7 +4120,7 @@ async def mochi_status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def backup_db_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.effective_user is not None
     user_id = update.effective_user.id
-    path = snapshot_db_backup(user_id, "manual")
+    path = await asyncio.to_thread(snapshot_db_backup, user_id, "manual")
     await update.message.reply_text(f"Created backup: {os.path.basename(path)}")
 
 
@@ -3424,12 +4134,11 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("I can't see a photo in this message.")
         return
     best = photo_sizes[-1]
-    await update.message.chat.send_action(ChatAction.TYPING)
+    _show_chat_action(update, ChatAction.TYPING)
     file = await context.bot.get_file(best.file_id)
-    bio = io.BytesIO()
-    await file.download_to_memory(out=bio)
-    image_bytes = bio.getvalue()
-    saved_path = persist_source_bytes(user_id, f"{best.file_unique_id}.jpg", image_bytes)
+    # Download straight to the source file; the bytes are only read back for the OpenAI path.
+    saved_path = reserve_source_path(user_id, f"{best.file_unique_id}.jpg")
+    await file.download_to_drive(custom_path=saved_path)
 
     with db_conn() as conn:
         source_id = add_source(
@@ -3450,10 +4159,12 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         if CARD_GENERATION_BACKEND == "openai-api":
-            data_url = image_to_data_url(image_bytes)
-            notes = openai_generate_notes_from_image(data_url, ANKI_LANG)
+            # Reading and base64-encoding a multi-MB photo would stall other handlers; do both in a thread.
+            data_url = await asyncio.to_thread(image_file_to_data_url, saved_path)
+            notes = await asyncio.to_thread(openai_generate_notes_from_image, data_url, ANKI_LANG)
             if notes:
-                created = store_generated_notes(conn, user_id, source_id, notes, origin="openai")
+                # The notes and the status change commit together.
+                created = store_generated_notes(conn, user_id, source_id, notes, origin="openai", commit=False)
                 set_source_status(conn, user_id, source_id, "processed")
                 await update.message.reply_text(
                     f"Added {created} card(s) from source #{source_id}.\n\n{format_note_previews(notes)}"
@@ -3480,16 +4191,20 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    await update.message.chat.send_action(ChatAction.TYPING)
+    _show_chat_action(update, ChatAction.TYPING)
     remote = await context.bot.get_file(doc.file_id)
-    bio = io.BytesIO()
-    await remote.download_to_memory(out=bio)
-    payload = bio.getvalue()
 
     guessed_ext = Path(doc.file_name or "").suffix or mimetypes.guess_extension(doc.mime_type or "") or ".bin"
     suggested_name = doc.file_name or f"{doc.file_unique_id}{guessed_ext}"
-    saved_path = persist_source_bytes(user_id, suggested_name, payload)
-    extracted_text = extract_text_from_document(doc.file_name or "", doc.mime_type or "", payload)
+    saved_path = reserve_source_path(user_id, suggested_name)
+    await remote.download_to_drive(custom_path=saved_path)
+    # Binary documents are never loaded into memory; text-like ones are read back and decoded
+    # (up to MAX_DOCUMENT_BYTES) in a worker thread.
+    extracted_text = ""
+    if document_looks_text(doc.file_name or "", doc.mime_type or ""):
+        extracted_text = await asyncio.to_thread(
+            extract_text_from_document_file, saved_path, doc.file_name or "", doc.mime_type or ""
+        )
     source_type = "telegram_document_text" if extracted_text else "telegram_document_binary"
     caption = (update.message.caption or "").strip()
 
@@ -3513,9 +4228,10 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         if extracted_text and CARD_GENERATION_BACKEND == "openai-api":
-            notes = openai_generate_notes_from_text(extracted_text, ANKI_LANG)
+            notes = await asyncio.to_thread(openai_generate_notes_from_text, extracted_text, ANKI_LANG)
             if notes:
-                created = store_generated_notes(conn, user_id, source_id, notes, origin="openai")
+                # The notes and the status change commit together.
+                created = store_generated_notes(conn, user_id, source_id, notes, origin="openai", commit=False)
                 set_source_status(conn, user_id, source_id, "processed")
                 await update.message.reply_text(
                     f"Added {created} card(s) from source #{source_id}.\n\n{format_note_previews(notes)}"
@@ -3538,18 +4254,17 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if content.startswith("/"):
         return
     if update.message.reply_to_message:
-        feedback = _extract_feedback_text(content)
-        if feedback or PROPOSAL_FEEDBACK_RE.match(content):
+        feedback_match = PROPOSAL_FEEDBACK_RE.match(content)
+        if feedback_match:
             await _handle_proposal_feedback(
                 update,
                 user_id=user_id,
                 replied_message_id=update.message.reply_to_message.message_id,
-                feedback_text=feedback,
+                feedback_text=(feedback_match.group(1) or "").strip(),
                 strict=True,
             )
             return
 
-    await update.message.chat.send_action(ChatAction.TYPING)
     url_match = URL_ONLY_RE.match(content)
     with db_conn() as conn:
         if url_match:
@@ -3579,8 +4294,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             status="pending",
         )
 
+        # Only the generation paths below are slow enough for a typing indicator; the plain
+        # "stored" reply is immediate and would arrive before it.
         if CARD_GENERATION_BACKEND == "codex-ui-queue" and AUTO_PROPOSE_FROM_TEXT:
             # Use the same proposal workflow as /propose for plain text messages.
+            _show_chat_action(update, ChatAction.TYPING)
             await _create_and_send_proposals(
                 update,
                 user_id=user_id,
@@ -3591,9 +4309,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         if CARD_GENERATION_BACKEND == "openai-api":
-            notes = openai_generate_notes_from_text(clipped, ANKI_LANG)
+            _show_chat_action(update, ChatAction.TYPING)
+            notes = await asyncio.to_thread(openai_generate_notes_from_text, clipped, ANKI_LANG)
             if notes:
-                created = store_generated_notes(conn, user_id, source_id, notes, origin="openai")
+                # The notes and the status change commit together.
+                created = store_generated_notes(conn, user_id, source_id, notes, origin="openai", commit=False)
                 set_source_status(conn, user_id, source_id, "processed")
                 await update.message.reply_text(
                     f"Added {created} card(s) from source #{source_id}.\n\n{format_note_previews(notes)}"
@@ -3613,6 +4333,50 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -------------------------
 # main
 # -------------------------
+# Command name -> handler, in /help order; main() registers them all through dispatch_command.
+COMMAND_HANDLERS: Dict[str, Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]] = {
+    # Core
+    "start": start,
+    "help": help_cmd,
+    "status": status_cmd,
+    "setdeck": setdeck,
+    "addbasic": addbasic_cmd,
+    "addcloze": addcloze_cmd,
+    "propose": propose_cmd,
+    "feedback": feedback_cmd,
+    "propose_source": propose_source_cmd,
+    "propose_pending": propose_pending_cmd,
+    "queue": queue_cmd,
+    "source_done": source_done_cmd,
+    "source_ignore": source_ignore_cmd,
+    "export": export_cmd,
+    "export_csv": export_csv_cmd,
+    "export_audit": export_audit_cmd,
+    "clear": clear_cmd,
+    # Mochi
+    "export_mochi": export_mochi_cmd,
+    "sync_mochi_push": sync_mochi_push_cmd,
+    "sync_mochi_pull": sync_mochi_pull_cmd,
+    "sync_mochi": sync_mochi_cmd,
+    "mochi_repair_cards": mochi_repair_cards_cmd,
+    "mochi_setkey": mochi_setkey_cmd,
+    "mochi_decks": mochi_decks_cmd,
+    "mochi_createdeck": mochi_createdeck_cmd,
+    "mochi_setdeck": mochi_setdeck_cmd,
+    "mochi_status": mochi_status_cmd,
+    "backup_db": backup_db_cmd,
+}
+
+
+async def dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # CommandHandler only lets through messages whose text starts with one of our commands,
+    # e.g. "/propose@SomeBot args"; the name is what sits between "/" and "@" or the first space.
+    assert update.message is not None
+    token = (update.message.text or "").split(maxsplit=1)[0]
+    name = token[1:].split("@", 1)[0].lower()
+    await COMMAND_HANDLERS[name](update, context)
+
+
 def main():
     try:
         asyncio.get_event_loop()
@@ -3621,37 +4385,9 @@ def main():
 
     application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
 
-    # Core
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_cmd))
-    application.add_handler(CommandHandler("status", status_cmd))
-    application.add_handler(CommandHandler("setdeck", setdeck))
-    application.add_handler(CommandHandler("addbasic", addbasic_cmd))
-    application.add_handler(CommandHandler("addcloze", addcloze_cmd))
-    application.add_handler(CommandHandler("propose", propose_cmd))
-    application.add_handler(CommandHandler("feedback", feedback_cmd))
-    application.add_handler(CommandHandler("propose_source", propose_source_cmd))
-    application.add_handler(CommandHandler("propose_pending", propose_pending_cmd))
-    application.add_handler(CommandHandler("queue", queue_cmd))
-    application.add_handler(CommandHandler("source_done", source_done_cmd))
-    application.add_handler(CommandHandler("source_ignore", source_ignore_cmd))
-    application.add_handler(CommandHandler("export", export_cmd))
-    application.add_handler(CommandHandler("export_csv", export_csv_cmd))
-    application.add_handler(CommandHandler("export_audit", export_audit_cmd))
-    application.add_handler(CommandHandler("clear", clear_cmd))
-
-    # Mochi
-    application.add_handler(CommandHandler("export_mochi", export_mochi_cmd))
-    application.add_handler(CommandHandler("sync_mochi_push", sync_mochi_push_cmd))
-    application.add_handler(CommandHandler("sync_mochi_pull", sync_mochi_pull_cmd))
-    application.add_handler(CommandHandler("sync_mochi", sync_mochi_cmd))
-    application.add_handler(CommandHandler("mochi_repair_cards", mochi_repair_cards_cmd))
-    application.add_handler(CommandHandler("mochi_setkey", mochi_setkey_cmd))
-    application.add_handler(CommandHandler("mochi_decks", mochi_decks_cmd))
-    application.add_handler(CommandHandler("mochi_createdeck", mochi_createdeck_cmd))
-    application.add_handler(CommandHandler("mochi_setdeck", mochi_setdeck_cmd))
-    application.add_handler(CommandHandler("mochi_status", mochi_status_cmd))
-    application.add_handler(CommandHandler("backup_db", backup_db_cmd))
+    # One CommandHandler for every command: PTB checks the name against a set, instead of asking
+    # each of ~25 handlers in turn for every incoming update.
+    application.add_handler(CommandHandler(list(COMMAND_HANDLERS), dispatch_command))
 
     # Content handlers
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
@@ -3665,7 +4401,21 @@ def main():
         CARD_GENERATION_BACKEND,
         PROPOSAL_GENERATION_BACKEND,
     )
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Only the update kinds registered above; message_reaction must be listed explicitly to be delivered.
+    allowed_updates = [Update.MESSAGE, Update.MESSAGE_REACTION]
+    if TELEGRAM_WEBHOOK_URL:
+        # Needs python-telegram-bot[webhooks] and a reverse proxy or port forward to this listener.
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=TELEGRAM_WEBHOOK_PORT,
+            url_path="telegram",
+            webhook_url=f"{TELEGRAM_WEBHOOK_URL}/telegram",
+            secret_token=TELEGRAM_WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+        )
+        return
+    # A 50 s long poll keeps an idle bot to about one getUpdates request per minute.
+    application.run_polling(allowed_updates=allowed_updates, timeout=50)
 
 
 if __name__ == "__main__":